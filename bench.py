@@ -0,0 +1,842 @@
+# --- Benchmarks and harnesses for food5.py ---
+# Everything here runs against a local stand-in for cuisineaz.com, never the live site.
+#
+#   python bench.py fetch [--sitemaps 6] [--urls 2000] [--latency 0.3] [--fail-first 1]
+#   python bench.py sitemap [--urls 50000] [--bandwidth 4000000]
+#   python bench.py extract [--repeat 200]
+#   python bench.py ingredients [--recipes 20000]
+#   python bench.py load [--recipes 20000] [--seconds 2]
+#   python bench.py catalog [--recipes 100000] [--workers 4]
+#   python bench.py upstream [--requests 40] [--workers 8] [--hang 2.0] [--deadline 0.5]
+#   python bench.py suite [--urls 100000] [--latency 0.02] [--save-baseline F | --baseline F]
+
+import argparse
+import gzip
+import itertools
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# food5 reads its configuration at import time: keep the benchmark database out of the
+# working tree, make retries fast enough for a harness, lift the upstream rate limit (the
+# stand-in is local; `upstream` sets its own) and silence the warnings logged for
+# fixtures that are empty on purpose.
+os.environ.setdefault('RECIPES_DB_PATH', os.path.join(tempfile.mkdtemp(prefix='food5-bench-'), 'recipes.db'))
+os.environ.setdefault('HTTP_BACKOFF_FACTOR', '0.01')
+os.environ.setdefault('UPSTREAM_RATE', '0')
+os.environ.setdefault('LOG_LEVEL', 'CRITICAL')
+
+import requests
+from flask import render_template_string
+import food5
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+# --- Local Upstream Stand-in ---
+class StandInServer:
+    """Serves in-memory documents over HTTP with injected latency and failures.
+
+    `routes` maps a path to (body_bytes, content_type). `latency` is added to every
+    response, `fail_rate` answers 503 at random and `fail_first` answers 503 to the
+    first N requests of each path (useful to check retries deterministically).
+    `bandwidth` (bytes/second) throttles bodies so that downloads take real time, and
+    `truncate` cuts every 200 body in half and drops the connection (the client sees an
+    incomplete read). Query strings are ignored when matching routes, so `?n=1`, `?n=2`... give distinct
+    URLs (and cache keys) for the same document.
+    """
+
+    def __init__(self, routes=None, latency=0.0, fail_rate=0.0, fail_first=0, seed=0, bandwidth=None, truncate=False):
+        self.routes = dict(routes or {})
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.truncate = truncate
+        self.fail_rate = fail_rate
+        self.fail_first = fail_first
+        self.hits = {}
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.httpd = None
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}{path}"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, like the real upstream
+            disable_nagle_algorithm = True  # Headers and body are separate writes
+
+            def do_GET(self):
+                with server.lock:
+                    hit = server.hits[self.path] = server.hits.get(self.path, 0) + 1
+                    fail = hit <= server.fail_first or server.random.random() < server.fail_rate
+                if server.latency:
+                    time.sleep(server.latency)
+                route = server.routes.get(self.path.split('?', 1)[0])
+                if route is None or fail:
+                    status, body, content_type = (404 if route is None else 503), b'', 'text/plain'
+                else:
+                    status, (body, content_type) = 200, route
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if server.truncate and status == 200:
+                    body = body[:len(body) // 2]
+                    self.close_connection = True
+                try:
+                    if not server.bandwidth:
+                        self.wfile.write(body)
+                        return
+                    chunk_size = 16 * 1024
+                    for offset in range(0, len(body), chunk_size):
+                        self.wfile.write(body[offset:offset + chunk_size])
+                        time.sleep(chunk_size / server.bandwidth)
+                except (BrokenPipeError, ConnectionResetError):
+                    self.close_connection = True  # The client gave up (deadline)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+# --- Synthetic Fixtures ---
+def make_sitemap(count, offset=0, base='https://www.cuisineaz.com'):
+    """Builds a recipe sitemap (urlset with image:image entries) with `count` URLs."""
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n'
+             '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" '
+             'xmlns:image="http://www.google.com/schemas/sitemap-image/1.1">\n']
+    for i in range(offset, offset + count):
+        parts.append(f'<url><loc>{base}/recettes/recette-synthetique-{i}.aspx</loc>'
+                     f'<image:image><image:loc>{base}/images/recette-{i}.jpg</image:loc></image:image></url>\n')
+    parts.append('</urlset>\n')
+    return ''.join(parts).encode('utf-8')
+
+
+def make_sitemap_index(sitemap_urls):
+    """Builds a <sitemapindex> pointing at `sitemap_urls`."""
+    entries = ''.join(f'<sitemap><loc>{u}</loc></sitemap>' for u in sitemap_urls)
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{entries}</sitemapindex>\n').encode('utf-8')
+
+
+def check(condition, message):
+    print(f"  [{'PASS' if condition else 'FAIL'}] {message}")
+    return condition
+
+
+# --- fetch: pooled/concurrent sitemap fetching ---
+def bench_fetch(args):
+    routes = {f'/sitemap-{i}.xml': (make_sitemap(args.urls, i * args.urls), 'application/xml')
+              for i in range(args.sitemaps)}
+    ok = True
+    with StandInServer(routes, latency=args.latency, fail_first=args.fail_first) as server:
+        # Half the sitemaps are listed directly, the rest behind a sitemap index
+        direct = [server.url(f'/sitemap-{i}.xml') for i in range(args.sitemaps // 2)]
+        indexed = [server.url(f'/sitemap-{i}.xml') for i in range(args.sitemaps // 2, args.sitemaps)]
+        server.routes['/sitemap-index.xml'] = (make_sitemap_index(indexed), 'application/xml')
+        all_sitemaps = direct + indexed
+
+        print(f"Sequential bare requests.get over {len(all_sitemaps)} sitemaps "
+              f"(latency {args.latency}s, first {args.fail_first} hit(s) per path fail):")
+        start = time.perf_counter()
+        sequential_count = 0
+        for url in all_sitemaps:
+            for _ in range(args.fail_first + 1):
+                response = requests.get(url, headers=food5.HEADERS, timeout=25)
+                if response.ok:
+                    sequential_count += len(food5.parse_sitemap_xml(response.content)[0])
+                    break
+        sequential_time = time.perf_counter() - start
+        print(f"  {sequential_count} recipes in {sequential_time:.2f}s")
+
+        server.hits.clear()
+        food5.SITEMAP_URLS = direct + [server.url('/sitemap-index.xml')]
+        print("Pooled session, concurrent fetch, retries (food5.refresh_catalog):")
+        start = time.perf_counter()
+        food5.refresh_catalog(force=True)
+        pooled_time = time.perf_counter() - start
+        recipes, errors = food5.load_catalog()
+        print(f"  {len(recipes)} recipes in {pooled_time:.2f}s")
+
+        ok &= check(not errors, f"no sitemap errors reported ({errors or 'none'})")
+        ok &= check(len(recipes) == args.sitemaps * args.urls, "every synthetic recipe is in the catalog")
+        if args.fail_first:
+            ok &= check(all(h == args.fail_first + 1 for h in server.hits.values()),
+                        "each failing path was retried until it succeeded")
+        # Two levels (index, then children) each cost one round-trip plus retries
+        slowest_chain = 2 * (args.fail_first + 1) * args.latency
+        ok &= check(pooled_time < max(slowest_chain * 2, sequential_time / 2),
+                    f"wall time ({pooled_time:.2f}s) tracks the slowest fetch chain (~{slowest_chain:.2f}s), "
+                    f"not the sum ({sequential_time:.2f}s)")
+    return ok
+
+
+# --- sitemap: streaming iterparse vs full-tree parsing ---
+def legacy_fetch_and_parse_recipes(url):
+    """The original implementation: download everything, ET.fromstring, findall."""
+    namespaces = food5.SITEMAP_NAMESPACES
+    response = requests.get(url, headers=food5.HEADERS, timeout=25)
+    response.raise_for_status()
+    root = ET.fromstring(response.content)
+    recipes = []
+    for url_element in root.findall('sitemap:url', namespaces):
+        loc_element = url_element.find('sitemap:loc', namespaces)
+        image_element = url_element.find('image:image', namespaces)
+        image_loc_element = image_element.find('image:loc', namespaces) if image_element is not None else None
+        if loc_element is not None and loc_element.text:
+            recipes.append({'url': loc_element.text,
+                            'image_url': image_loc_element.text if image_loc_element is not None else None})
+    return recipes
+
+
+def peak_rss_kib():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def sitemap_worker(args):
+    """Runs one parser in a fresh process so that peak RSS is not shared between modes."""
+    rss_before = peak_rss_kib()
+    start = time.perf_counter()
+    first_record = None
+    count = 0
+    if args.mode == 'legacy':
+        recipes = legacy_fetch_and_parse_recipes(args.url)
+        first_record = time.perf_counter() - start
+        count = len(recipes)
+    else:
+        # Records are consumed one by one (e.g. written to the catalog), not accumulated
+        for _ in food5.iter_sitemap_recipes(args.url):
+            if first_record is None:
+                first_record = time.perf_counter() - start
+            count += 1
+    print(json.dumps({'mode': args.mode, 'count': count, 'total': time.perf_counter() - start,
+                      'first_record': first_record, 'rss_delta_kib': peak_rss_kib() - rss_before}))
+    return True
+
+
+def bench_sitemap(args):
+    body = make_sitemap(args.urls)
+    ok = True
+    with StandInServer(bandwidth=args.bandwidth) as server:
+        server.routes['/sitemap.xml'] = (body, 'application/xml')
+        server.routes['/sitemap.xml.gz'] = (gzip.compress(body), 'application/x-gzip')
+        server.routes['/sitemap-index.xml'] = (make_sitemap_index([server.url('/sitemap.xml.gz')]), 'application/xml')
+        speed = f"{args.bandwidth / 1e6:.1f} MB/s" if args.bandwidth else "unthrottled"
+        print(f"Synthetic sitemap: {args.urls} URLs, {len(body) / 1e6:.1f} MB, served {speed}")
+        results = {}
+        for mode in ('legacy', 'streaming'):
+            output = subprocess.run([sys.executable, __file__, '_sitemap-worker', mode, server.url('/sitemap.xml')],
+                                    check=True, capture_output=True, text=True).stdout
+            results[mode] = json.loads(output.strip().splitlines()[-1])
+        print(f"  {'mode':<10} {'records':>8} {'total s':>8} {'first record s':>15} {'peak RSS +MiB':>14}")
+        for mode, r in results.items():
+            print(f"  {mode:<10} {r['count']:>8} {r['total']:>8.2f} {r['first_record']:>15.3f} "
+                  f"{r['rss_delta_kib'] / 1024:>14.1f}")
+        legacy, streaming = results['legacy'], results['streaming']
+        ok &= check(legacy['count'] == streaming['count'] == args.urls, "both parsers return every record")
+        ok &= check(streaming['first_record'] < legacy['first_record'], "streaming yields its first record earlier")
+        ok &= check(streaming['rss_delta_kib'] < legacy['rss_delta_kib'], "streaming has the lower peak RSS")
+        gz_count = sum(1 for _ in food5.iter_sitemap_recipes(server.url('/sitemap-index.xml')))
+        ok &= check(gz_count == args.urls, "sitemap index -> .xml.gz child is followed and decompressed")
+    return ok
+
+
+# --- extract: recipe page extractor parity and per-page parse time ---
+def load_recipe_fixtures():
+    """Returns {name: html_bytes} for the saved recipe pages in fixtures/recipes."""
+    directory = os.path.join(FIXTURES_DIR, 'recipes')
+    fixtures = {}
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.html'):
+            with open(os.path.join(directory, name), 'rb') as f:
+                fixtures[name] = f.read()
+    return fixtures
+
+
+def bench_extract(args):
+    fixtures = load_recipe_fixtures()
+    reference = 'soup'
+    ok = True
+    print(f"Parity against the '{reference}' extractor on {len(fixtures)} fixtures:")
+    results = {name: {backend: extract(html) for backend, extract in food5.RECIPE_EXTRACTORS.items()}
+               for name, html in fixtures.items()}
+    for name, by_backend in results.items():
+        for backend, result in by_backend.items():
+            if backend != reference:
+                ok &= check(result == by_backend[reference], f"{name}: {backend} == {reference}")
+
+    print(f"Per-page parse time ({args.repeat} runs per fixture):")
+    print(f"  {'fixture':<28}" + ''.join(f"{backend + ' ms':>12}" for backend in food5.RECIPE_EXTRACTORS))
+    totals = dict.fromkeys(food5.RECIPE_EXTRACTORS, 0.0)
+    for name, html in fixtures.items():
+        row = f"  {name:<28}"
+        for backend, extract in food5.RECIPE_EXTRACTORS.items():
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                extract(html)
+            elapsed = (time.perf_counter() - start) / args.repeat * 1000
+            totals[backend] += elapsed
+            row += f"{elapsed:>12.3f}"
+        print(row)
+    print(f"  {'total':<28}" + ''.join(f"{totals[backend]:>12.3f}" for backend in totals))
+    fastest = min(totals, key=totals.get)
+    print(f"  fastest: {fastest} ({totals[reference] / totals[fastest]:.1f}x faster than {reference})")
+    return ok
+
+
+# --- ingredients: ingredient index queries over a synthetic catalog ---
+INGREDIENT_BASES = ['poulet', 'citron', 'crème fraîche', 'beurre', 'farine', 'oeufs', 'lait', 'sucre', 'ail', 'oignon',
+                    'échalote', 'tomates', 'pommes de terre', 'carottes', 'thym', 'laurier', 'persil', 'riz', 'pâtes',
+                    'boeuf', 'porc', 'saumon', 'cabillaud', 'crevettes', 'fromage râpé', 'parmesan', 'chocolat noir',
+                    'huile d\'olive', 'vinaigre balsamique', 'moutarde', 'miel', 'courgettes', 'aubergine', 'poivron']
+INGREDIENT_QUALIFIERS = ['', ' frais', ' bio', ' surgelé', ' en poudre', ' émincé', ' de Bretagne', ' fermier']
+
+
+def synthetic_ingredient_catalog(count, seed=0):
+    """Returns (catalog, {url: [ingredient names]}) with a skewed (Zipf-like) ingredient distribution."""
+    rng = random.Random(seed)
+    names = [base + qualifier for base in INGREDIENT_BASES for qualifier in INGREDIENT_QUALIFIERS]
+    names += ['épice ' + ''.join(chr(ord('a') + int(digit)) for digit in str(i)) for i in range(300)]
+    weights = [1 / (rank + 1) for rank in range(len(names))]
+    records, ingredients = [], {}
+    for i in range(count):
+        url = f'https://www.cuisineaz.com/recettes/recette-synthetique-{i}.aspx'
+        records.append((i + 1, url, None))
+        ingredients[url] = ['Sel', 'Poivre'] + rng.choices(names, weights, k=rng.randint(4, 10))
+    return food5.CompactCatalog.from_records(records), ingredients
+
+
+def bench_ingredients(args):
+    documents, ingredients = synthetic_ingredient_catalog(args.recipes)
+    start = time.perf_counter()
+    index = food5.IngredientIndex(documents, ingredients)
+    print(f"Built ingredient index over {args.recipes} recipes ({len(index.name_bitmaps)} distinct names) "
+          f"in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    queries = {
+        'poulet AND citron': {'all_of': ['poulet', 'citron']},
+        'poulet AND citron NOT crème': {'all_of': ['poulet', 'citron'], 'none_of': ['crème']},
+        'saumon OR cabillaud OR crevettes': {'any_of': ['saumon', 'cabillaud', 'crevettes']},
+        'pantry (12 items)': {'pantry': ['oeufs', 'farine', 'lait', 'beurre', 'sucre', 'chocolat noir', 'poulet',
+                                         'citron', 'ail', 'oignon', 'thym', 'riz']},
+    }
+    # Reference answers by brute force over the normalized ingredient sets
+    normalized = {documents.find(url): [food5.ingredient_tokens(n) for n in names] for url, names in ingredients.items()}
+
+    def uses(doc, term):
+        term_tokens = food5.ingredient_tokens(term)
+        return any(all(t in tokens for t in term_tokens) for tokens in normalized[doc])
+
+    def brute_force(all_of=(), any_of=(), none_of=(), pantry=None):
+        pantry_terms = list(pantry or ()) + list(food5.PANTRY_STAPLES)
+        return {doc for doc in normalized
+                if all(uses(doc, t) for t in all_of)
+                and (not any_of or any(uses(doc, t) for t in any_of))
+                and not any(uses(doc, t) for t in none_of)
+                and (pantry is None or all(any(all(t in tokens for t in food5.ingredient_tokens(term))
+                                               for term in pantry_terms) for tokens in normalized[doc]))}
+
+    ok = True
+    print(f"  {'query':<36} {'matches':>8} {'median ms':>10} {'max ms':>8}")
+    for label, query in queries.items():
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            total, _ = index.search(1, 48, **query)
+            timings.append((time.perf_counter() - start) * 1000)
+        print(f"  {label:<36} {total:>8} {statistics.median(timings):>10.2f} {max(timings):>8.2f}")
+        ok &= check(set(food5.iter_bits(index.query(**query))) == brute_force(**query), f"{label}: same recipes as brute force")
+        ok &= check(statistics.median(timings) < args.budget_ms, f"{label}: median under {args.budget_ms} ms")
+    return ok
+
+
+# --- load: requests/sec and bytes on the wire for the home page ---
+def populate_catalog(count):
+    """Stores a synthetic catalog of `count` recipes as if the sitemap had just been fetched."""
+    sitemap_url = 'https://www.cuisineaz.com/xml/sitemap-bench.xml'
+    food5.SITEMAP_URLS = [sitemap_url]
+    recipes = food5.parse_sitemap_xml(make_sitemap(count))[0]
+    food5.store_sitemap_recipes(food5.get_db(), sitemap_url, recipes, {})
+
+
+def bench_load(args):
+    populate_catalog(args.recipes)
+
+    @food5.app.route('/_bench/full-render')
+    def full_render():
+        # What '/' used to do: render every catalog recipe from the template string on each request
+        recipes, errors = food5.load_catalog()
+        documents = food5.get_search_index().documents
+        return render_template_string(food5.HTML_TEMPLATE, recipes=documents, total=len(recipes),
+                                      page_size=food5.SEARCH_PAGE_SIZE, errors=errors)
+
+    client = food5.app.test_client()
+    etag = client.get('/').headers['ETag']
+    scenarios = [('before: full render per request', '/_bench/full-render', {}),
+                 ('after: cached, identity', '/', {}),
+                 ('after: cached, gzip', '/', {'Accept-Encoding': 'gzip'})]
+    if food5.brotli is not None:
+        scenarios.append(('after: cached, brotli', '/', {'Accept-Encoding': 'gzip, br'}))
+    scenarios.append(('after: revalidation (304)', '/', {'Accept-Encoding': 'gzip', 'If-None-Match': etag}))
+
+    print(f"GET / on a {args.recipes}-recipe catalog, {args.seconds}s per scenario (in-process test client):")
+    print(f"  {'scenario':<36} {'req/s':>10} {'bytes/response':>15} {'status':>7}")
+    results = {}
+    for label, path, headers in scenarios:
+        count, size, deadline = 0, 0, time.perf_counter() + args.seconds
+        start = time.perf_counter()
+        while time.perf_counter() < deadline or count == 0:
+            response = client.get(path, headers=headers)
+            size = len(response.data)
+            count += 1
+        results[label] = (count / (time.perf_counter() - start), size, response.status_code)
+        print(f"  {label:<36} {results[label][0]:>10.1f} {size:>15,} {response.status_code:>7}")
+
+    before = results['before: full render per request']
+    gzip_result = results['after: cached, gzip']
+    ok = check(gzip_result[0] > before[0] * 10, "cached gzip page serves >10x more requests/sec than a full render")
+    ok &= check(gzip_result[1] * 10 < before[1], "gzip page is >10x smaller on the wire")
+    ok &= check(results['after: revalidation (304)'][2] == 304, "matching If-None-Match answers 304")
+    return ok
+
+
+# --- catalog: per-worker memory of the in-memory catalog ---
+def private_rss_kib():
+    """Resident memory not backed by a file (RssAnon): what each worker process pays on its own."""
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('RssAnon:'):
+                return int(line.split()[1])
+    return 0
+
+
+def catalog_worker(args):
+    """Loads the catalog the way one web worker does and reports the private memory it costs."""
+    conn = food5.get_db()
+    rss_before = private_rss_kib()
+    start = time.perf_counter()
+    if args.mode == 'dicts':
+        # The previous representation: catalog dicts, search documents with titles, URL -> position
+        recipes = [{'id': row['id'], 'url': row['url'], 'image_url': row['image_url']}
+                   for row in conn.execute("SELECT id, url, image_url FROM recipes ORDER BY sitemap_rank, position")]
+        documents = [dict(recipe, title=food5.recipe_title(recipe['url'])) for recipe in recipes]
+        doc_by_url = {document['url']: doc for doc, document in enumerate(documents)}
+    else:
+        catalog, _ = food5.load_catalog()
+        for doc in range(len(catalog)):  # Touch every page of the snapshot, as an index build does
+            catalog.title(doc)
+    print(json.dumps({'mode': args.mode, 'load_s': time.perf_counter() - start,
+                      'private_kib': private_rss_kib() - rss_before}))
+    return True
+
+
+def bench_catalog(args):
+    if not os.path.exists('/proc/self/status'):
+        print("Needs Linux (/proc/self/status) to read per-process private memory")
+        return False
+    populate_catalog(args.recipes)
+    catalog, _ = food5.load_catalog()  # Writes the shared snapshot once, as the first worker would
+    print(f"{args.recipes}-recipe catalog, {args.workers} worker processes per mode:")
+    print(f"  {'mode':<10} {'load s':>8} {'private MiB/worker':>19} {'total MiB':>10}")
+    results = {}
+    for mode in ('dicts', 'compact'):
+        workers = [subprocess.Popen([sys.executable, __file__, '_catalog-worker', mode], stdout=subprocess.PIPE, text=True)
+                   for _ in range(args.workers)]
+        reports = [json.loads(worker.communicate()[0].strip().splitlines()[-1]) for worker in workers]
+        private = statistics.mean(r['private_kib'] for r in reports) / 1024
+        results[mode] = private
+        print(f"  {mode:<10} {statistics.mean(r['load_s'] for r in reports):>8.3f} {private:>19.1f} "
+              f"{private * args.workers:>10.1f}")
+    snapshot = food5.catalog_snapshot_path(food5.get_db(), food5.get_catalog_version())
+    print(f"  snapshot file (shared by every worker through the page cache): {os.path.getsize(snapshot) / 2 ** 20:.1f} MiB")
+    ok = check(catalog[0]['url'].endswith('recette-synthetique-0.aspx') and catalog.find(catalog[-1]['url']) == len(catalog) - 1,
+               "snapshot reads back the stored recipes")
+    ok &= check(results['compact'] * 4 < results['dicts'], "compact catalog costs each worker <1/4 of the private memory")
+    return ok
+
+
+# --- upstream: circuit breaker, deadlines and token bucket under injected faults ---
+def scrape_all(urls, workers):
+    """Scrapes `urls` on `workers` threads. Returns (seconds, number of results with ingredients, slowest scrape)."""
+    def scrape(url):
+        scrape_start = time.perf_counter()
+        details, _ = food5.scrape_recipe_details(url)
+        return bool(details['ingredients']), time.perf_counter() - scrape_start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(scrape, urls))
+    return time.perf_counter() - start, sum(found for found, _ in results), max(seconds for _, seconds in results)
+
+
+def bench_upstream(args):
+    page = (load_recipe_fixtures()['ingredient_item.html'], 'text/html; charset=utf-8')
+    page_deadline, food5.PAGE_DEADLINE_SECONDS = food5.PAGE_DEADLINE_SECONDS, args.deadline
+    ok = True
+
+    print(f"Upstream hanging for {args.hang}s, {args.requests} scrapes on {args.workers} threads, "
+          f"{args.deadline}s deadline per page:")
+    timings, slowest = {}, {}
+    for label, failures in (('no breaker', 10 ** 9), ('breaker', food5.BREAKER_FAILURES)):
+        with StandInServer({'/recette.aspx': page}, latency=args.hang) as server:
+            food5.upstream_host(server.url('/')).breaker.failures = failures
+            seconds, found, slowest[label] = scrape_all(
+                [server.url(f'/recette.aspx?n={i}') for i in range(args.requests)], args.workers)
+            hits = sum(server.hits.values())
+            timings[label] = seconds
+            print(f"  {label:<10} {seconds:6.2f}s, {hits:3d} requests reached the upstream, {found} pages, "
+                  f"slowest scrape {slowest[label]:.2f}s")
+    ok &= check(max(slowest.values()) <= args.deadline + 0.25,
+                f"every scrape ends at its deadline, not after the hang ({args.workers} threads share "
+                f"{food5.HTTP_MAX_PER_HOST} connection slots: waiting for one counts too)")
+    ok &= check(timings['breaker'] < timings['no breaker'] / 2, "the open breaker fails the remaining scrapes fast")
+
+    print("Upstream answering 503, then recovering (breaker cooldown 0.3s):")
+    with StandInServer({'/recette.aspx': page}, fail_rate=1.0) as server:
+        upstream = food5.upstream_host(server.url('/'))
+        upstream.breaker.cooldown = 0.3
+        upstream.bucket = food5.TokenBucket(100, 100)
+        stored_url = server.url('/recette.aspx?stored')
+        details, warning = food5.parse_recipe_details(page[0])
+        food5.DETAIL_CACHE.put(stored_url, details, warning, fetched_at=1.0)  # Past its TTL and stale window
+        food5.scrape_recipe_details(server.url('/recette.aspx?warmup'))
+        food5.scrape_recipe_details(server.url('/recette.aspx?warmup2'))
+        ok &= check(upstream.breaker.state == 'open', f"breaker opened after {food5.BREAKER_FAILURES} failures "
+                    f"({sum(server.hits.values())} requests)")
+        metrics = food5.METRICS.render(food5.upstream_samples())
+        ok &= check(f'food5_upstream_breaker_state{{host="{upstream.host}"}} 2' in metrics, "/metrics reports the open breaker")
+        hits = sum(server.hits.values())
+        start = time.perf_counter()
+        _, error_message = food5.scrape_recipe_details(server.url('/recette.aspx?fast'))
+        ok &= check(sum(server.hits.values()) == hits and time.perf_counter() - start < 0.05,
+                    f"scrapes fail fast without touching the upstream ({error_message})")
+        served, _ = food5.DETAIL_CACHE.get(stored_url)
+        ok &= check(bool(served['ingredients']), "an expired stored copy is served while the upstream is down")
+        ok &= check(upstream.bucket.rate < upstream.bucket.max_rate,
+                    f"503 answers lowered the host's request rate (now {upstream.bucket.rate:g}/s)")
+        server.fail_rate = 0.0
+        time.sleep(0.35)
+        details, _ = food5.scrape_recipe_details(server.url('/recette.aspx?recovered'))
+        ok &= check(bool(details['ingredients']) and upstream.breaker.state == 'closed',
+                    "after the cooldown a trial request closes the breaker")
+
+    print("Upstream answering 503, then truncated bodies (breaker opens after 1 failure, cooldown 0.2s):")
+    sitemap = (make_sitemap(2000), 'application/xml')
+    with StandInServer({'/recette.aspx': page, '/sitemap.xml': sitemap}, fail_first=1, truncate=True) as server:
+        upstream = food5.upstream_host(server.url('/'))
+        upstream.breaker.failures, upstream.breaker.cooldown = 1, 0.2
+        food5.scrape_recipe_details(server.url('/recette.aspx'))  # 503: opens the breaker
+        time.sleep(0.25)
+        _, error_message = food5.scrape_recipe_details(server.url('/recette.aspx'))  # Trial gets a truncated body
+        ok &= check(upstream.breaker.state == 'open', f"a truncated body fails the half-open trial ({error_message})")
+        server.truncate = False
+        time.sleep(0.25)
+        details, _ = food5.scrape_recipe_details(server.url('/recette.aspx'))
+        ok &= check(bool(details['ingredients']) and upstream.breaker.state == 'closed',
+                    "the next trial is still let through and closes the breaker")
+        server.truncate = True
+        upstream.breaker.failures = food5.BREAKER_FAILURES
+        _, _, error_message = food5.fetch_sitemap(server.url('/sitemap.xml?truncated'))
+        ok &= check(error_message is not None and upstream.breaker.consecutive_failures == 1,
+                    "a streamed sitemap cut off after its headers counts as a failure")
+
+    # Waiting for a token counts against the deadline: give the queued requests the default one
+    food5.PAGE_DEADLINE_SECONDS = page_deadline
+    print(f"Token bucket at {args.rate}/s (burst {args.burst}), {args.requests} requests on {args.workers} threads:")
+    with StandInServer({'/recette.aspx': page}) as server:
+        food5.upstream_host(server.url('/')).bucket = food5.TokenBucket(args.rate, args.burst)
+        seconds, found, _ = scrape_all([server.url(f'/recette.aspx?n={i}') for i in range(args.requests)], args.workers)
+        expected = (args.requests - args.burst) / args.rate
+        print(f"  {found} pages in {seconds:.2f}s")
+        ok &= check(found == args.requests and expected * 0.9 <= seconds <= expected * 1.5 + 0.5,
+                    f"requests are spread at the configured rate (~{expected:.2f}s)")
+    return ok
+
+
+# --- suite: every component and route, with a stored baseline ---
+EXTRACTOR_PATHS = ('li.ingredient_item', 'section.borderSection', 'ul.preparation_steps', 'section#preparation')
+# Quantity strings as they appear on cuisineaz.com -> parse_quantity() and format_quantity() at 3x
+QUANTITY_CASES = {
+    '200 g': ((200.0, 'g'), '600 g'), '100\xa0g': ((100.0, 'g'), '300 g'), '1,5 kg': ((1.5, 'kg'), '4,5 kg'),
+    '20 cl': ((20.0, 'cl'), '60 cl'), '½ l': ((0.5, 'l'), '1,5 l'), '1/2': ((0.5, None), '1 ½'),
+    '1 1/2': ((1.5, None), '4 ½'), '2 à 3 gousses': ((3.0, 'gousse'), '9 gousses'),
+    '1 c. à soupe': ((1.0, 'c. à soupe'), '3 c. à soupe'), '1 c. à s.': ((1.0, 'c. à soupe'), '3 c. à soupe'),
+    '2 c. à c.': ((2.0, 'c. à café'), '6 c. à café'), '1 cuil. à s.': ((1.0, 'c. à soupe'), '3 c. à soupe'),
+    '1 pincée': ((1.0, 'pincée'), '3 pincées'),
+    '-': ((None, None), None), 'quelques': ((None, None), None),
+}
+
+# metric -> True when higher is better. Timings get a small absolute slack so that
+# sub-millisecond components do not fail on scheduler noise; p99, decided by a handful
+# of samples in a run of a few seconds, gets more.
+BASELINE_METRICS = {'ops_per_s': True, 'p50_ms': False, 'p99_ms': False, 'peak_mib': False}
+BASELINE_SLACK = {'ops_per_s': 0.0, 'p50_ms': 0.05, 'p99_ms': 2.0, 'peak_mib': 0.1}
+# Distinct never-scraped catalog URLs for the cold /get_recipe_details run (one per call)
+COLD_DETAIL_URLS = 20_000
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    return sorted_values[min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))]
+
+
+def measure(operation, seconds, min_runs=5):
+    """Runs `operation` for about `seconds` (at least `min_runs` times) after one warm-up call.
+
+    Returns throughput, p50/p99 latency and the peak traced memory of one extra call
+    (measured separately because tracemalloc slows everything down).
+    """
+    operation()
+    latencies = []
+    start = time.perf_counter()
+    deadline = start + seconds
+    while len(latencies) < min_runs or time.perf_counter() < deadline:
+        call_start = time.perf_counter()
+        operation()
+        latencies.append(time.perf_counter() - call_start)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    operation()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    latencies.sort()
+    return {'runs': len(latencies), 'ops_per_s': len(latencies) / elapsed, 'p50_ms': percentile(latencies, 50) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000, 'peak_mib': peak / 2 ** 20}
+
+
+def load_fixture_manifest():
+    with open(os.path.join(FIXTURES_DIR, 'recipes', 'manifest.json')) as f:
+        return json.load(f)
+
+
+def extractor_paths(extract, html):
+    """Runs `extract` on `html` and returns the set of selector paths that produced its result."""
+    fallbacks = {'ingredients_border_section': 'section.borderSection', 'steps_preparation_section': 'section#preparation'}
+    before = {label: food5.METRICS.value('food5_extractor_fallback_total', path=label) for label in fallbacks}
+    details, _ = extract(html)
+    fired = {path for label, path in fallbacks.items()
+             if food5.METRICS.value('food5_extractor_fallback_total', path=label) > before[label]}
+    paths = set()
+    if details['ingredients']:
+        paths.add('section.borderSection' if 'section.borderSection' in fired else 'li.ingredient_item')
+    if details['steps']:
+        paths.add('section#preparation' if 'section#preparation' in fired else 'ul.preparation_steps')
+    return details, paths
+
+
+def check_fixture_corpus():
+    """Every extractor reproduces the manifest on every fixture, and the corpus covers every selector path."""
+    fixtures, manifest = load_recipe_fixtures(), load_fixture_manifest()
+    ok = check(set(fixtures) == set(manifest), "every recipe fixture is described in fixtures/recipes/manifest.json")
+    covered = set()
+    for name, html in fixtures.items():
+        expected = manifest.get(name, {})
+        for backend, extract in food5.RECIPE_EXTRACTORS.items():
+            details, paths = extractor_paths(extract, html)
+            found = {'ingredients': len(details['ingredients']), 'steps': len(details['steps']), 'paths': sorted(paths)}
+            ok &= check(found == {**expected, 'paths': sorted(expected.get('paths', []))}, f"{name} [{backend}]: {found}")
+            covered |= paths
+    ok &= check(covered == set(EXTRACTOR_PATHS), f"fixtures cover every selector path ({', '.join(EXTRACTOR_PATHS)})")
+    return ok
+
+
+def check_quantities():
+    ok = True
+    for text, (expected, tripled) in QUANTITY_CASES.items():
+        parsed = food5.parse_quantity(text)
+        shown = food5.format_quantity(parsed[0] * 3, parsed[1]) if parsed[0] is not None else None
+        ok &= check((parsed, shown) == (expected, tripled), f"{text!r} -> {parsed}, x3 {shown!r}")
+    return ok
+
+
+def compare_to_baseline(results, config, baseline, tolerance):
+    """Fails every metric that is more than `tolerance` (relative) worse than the stored baseline."""
+    ok = check(baseline['config'] == config, f"baseline was recorded with the same settings ({baseline['config']})")
+    regressions = []
+    for name, result in results.items():
+        reference = baseline['results'].get(name)
+        if reference is None:
+            print(f"  [NEW ] {name}: not in the baseline")
+            continue
+        for metric, higher_is_better in BASELINE_METRICS.items():
+            value, base = result[metric], reference[metric]
+            if higher_is_better:
+                regressed = value < base / (1 + tolerance) - BASELINE_SLACK[metric]
+            else:
+                regressed = value > base * (1 + tolerance) + BASELINE_SLACK[metric]
+            if regressed:
+                regressions.append(f"{name} {metric}: {value:.3f} (baseline {base:.3f})")
+    for regression in regressions:
+        check(False, f"regression: {regression}")
+    return ok & check(not regressions, f"no metric more than {tolerance:.0%} worse than the baseline")
+
+
+def bench_suite(args):
+    ok = True
+    print("Fixture corpus:")
+    ok &= check_fixture_corpus()
+    print("Quantities:")
+    ok &= check_quantities()
+
+    fixtures = load_recipe_fixtures()
+    routes = {f'/recettes/{name}': (html, 'text/html') for name, html in fixtures.items()}
+    with open(os.path.join(FIXTURES_DIR, 'sitemaps', 'sitemap-cuisineaz-recette.xml'), 'rb') as f:
+        routes['/sitemap-fixture.xml'] = (f.read(), 'application/xml')
+    routes['/sitemap-synthetic.xml'] = (make_sitemap(args.urls), 'application/xml')
+    results = {}
+
+    def run(name, operation, min_runs=5):
+        results[name] = r = measure(operation, args.seconds, min_runs)
+        print(f"  {name:<40} {r['runs']:>6} {r['ops_per_s']:>10.1f} {r['p50_ms']:>10.3f} {r['p99_ms']:>10.3f} {r['peak_mib']:>10.2f}")
+
+    with StandInServer(routes, latency=args.latency) as server:
+        fixture_sitemap = server.url('/sitemap-fixture.xml')
+        parsed = [{'url': r['url'], 'image_url': r['image_url']} for r in food5.fetch_and_parse_recipes(fixture_sitemap)[0]]
+        ok &= check(parsed == legacy_fetch_and_parse_recipes(fixture_sitemap),
+                    "fixture sitemap: same records as the original ElementTree parser")
+        food5.SITEMAP_URLS = [server.url('/sitemap-synthetic.xml')]
+        food5.refresh_catalog(force=True)
+        ok &= check(len(food5.load_catalog()[0]) == args.urls, f"synthetic sitemap: {args.urls} recipes in the catalog")
+
+        page_urls = itertools.cycle([server.url(f'/recettes/{name}') for name in fixtures])
+        pages = itertools.cycle(fixtures.values())
+        cold_ids = itertools.count()
+        client = food5.app.test_client()
+        cached_url = server.url('/recettes/ingredient_item.html')
+        # /get_recipe_details only serves catalog recipes: add the URLs it is measured on
+        conn = food5.get_db()
+        with conn:
+            conn.executemany("INSERT OR IGNORE INTO recipes (url, sitemap_rank, position) VALUES (?, 0, ?)",
+                             [(f'{cached_url}?n={i}', args.urls + i) for i in range(COLD_DETAIL_URLS)])
+            conn.execute("INSERT OR IGNORE INTO recipes (url, sitemap_rank, position) VALUES (?, 0, ?)",
+                         (cached_url, args.urls + COLD_DETAIL_URLS))
+
+        print(f"Components and routes ({args.seconds}s each, upstream latency {args.latency * 1000:.0f} ms, "
+              f"{args.urls} catalog recipes):")
+        print(f"  {'name':<40} {'runs':>6} {'ops/s':>10} {'p50 ms':>10} {'p99 ms':>10} {'peak MiB':>10}")
+        run('fetch_and_parse_recipes (synthetic)', lambda: food5.fetch_and_parse_recipes(food5.SITEMAP_URLS[0]), 3)
+        for backend in food5.RECIPE_EXTRACTORS:
+            run(f'parse_recipe_details [{backend}]', lambda: food5.parse_recipe_details(next(pages), extractor=backend))
+        run('scrape_recipe_details', lambda: food5.scrape_recipe_details(next(page_urls)))
+        run('GET / (gzip)', lambda: client.get('/', headers={'Accept-Encoding': 'gzip'}))
+        run('GET /api/search', lambda: client.get('/api/search?q=recette synth'))
+        run('GET /get_recipe_details (cold)',
+            lambda: client.get(f'/get_recipe_details?url={cached_url}?n={next(cold_ids)}'))
+        run('GET /get_recipe_details (cached)', lambda: client.get(f'/get_recipe_details?url={cached_url}'))
+        catalog = food5.load_catalog()[0]
+        batch_urls = [catalog.url(doc) for doc in range(min(12, len(catalog)))]
+        for url in batch_urls:
+            food5.DETAIL_CACHE.put(url, *food5.parse_recipe_details(fixtures['ingredient_item.html']))
+        run(f'POST /api/recipes/details ({len(batch_urls)} cached)',
+            lambda: client.post('/api/recipes/details', json={'urls': batch_urls}))
+        parsed_fixtures = [food5.parse_recipe_details(html)[0] for html in fixtures.values()]
+        shopping = [(details, 4) for details in itertools.islice(itertools.cycle(parsed_fixtures), 500)]
+        run('build_shopping_list (500 recipes)', lambda: food5.build_shopping_list(shopping))
+
+    config = {'urls': args.urls, 'latency': args.latency}
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'config': config, 'results': results}, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"Against baseline {args.baseline} (tolerance {args.tolerance:.0%}):")
+        ok &= compare_to_baseline(results, config, baseline, args.tolerance)
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks and harnesses for food5.py (local stand-in upstream only).')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    fetch = commands.add_parser('fetch', help='sequential vs pooled concurrent sitemap fetching')
+    fetch.add_argument('--sitemaps', type=int, default=6)
+    fetch.add_argument('--urls', type=int, default=2000, help='URLs per sitemap')
+    fetch.add_argument('--latency', type=float, default=0.3, help='injected seconds per response')
+    fetch.add_argument('--fail-first', type=int, default=1, help='503 answers before each path succeeds')
+    fetch.set_defaults(func=bench_fetch)
+
+    sitemap = commands.add_parser('sitemap', help='streaming vs full-tree sitemap parsing (peak RSS, first record)')
+    sitemap.add_argument('--urls', type=int, default=50000)
+    sitemap.add_argument('--bandwidth', type=float, default=4e6, help='bytes/second served, 0 for unthrottled')
+    sitemap.set_defaults(func=bench_sitemap)
+
+    extract = commands.add_parser('extract', help='recipe page extractors: parity with BeautifulSoup and parse time')
+    extract.add_argument('--repeat', type=int, default=200)
+    extract.set_defaults(func=bench_extract)
+
+    ingredients = commands.add_parser('ingredients', help='ingredient index AND/OR/NOT/pantry query latency')
+    ingredients.add_argument('--recipes', type=int, default=20000)
+    ingredients.add_argument('--repeat', type=int, default=50)
+    ingredients.add_argument('--budget-ms', type=float, default=20.0, help='max median latency per query')
+    ingredients.set_defaults(func=bench_ingredients)
+
+    load = commands.add_parser('load', help='home page requests/sec and bytes on the wire, before and after caching')
+    load.add_argument('--recipes', type=int, default=20000)
+    load.add_argument('--seconds', type=float, default=2.0)
+    load.set_defaults(func=bench_load)
+
+    suite = commands.add_parser('suite', help='throughput, p50/p99 latency and peak memory of every component and route')
+    suite.add_argument('--urls', type=int, default=100000, help='URLs in the synthetic sitemap (catalog size)')
+    suite.add_argument('--latency', type=float, default=0.02, help='injected upstream seconds per response')
+    suite.add_argument('--seconds', type=float, default=2.0, help='time spent on each component')
+    suite.add_argument('--save-baseline', metavar='PATH', help='store the results as the new baseline')
+    suite.add_argument('--baseline', metavar='PATH', help='fail on regressions against this baseline')
+    suite.add_argument('--tolerance', type=float, default=0.5, help='allowed relative slowdown before failing')
+    suite.set_defaults(func=bench_suite)
+
+    catalog = commands.add_parser('catalog', help='per-worker private memory: catalog dicts vs shared compact snapshot')
+    catalog.add_argument('--recipes', type=int, default=100000)
+    catalog.add_argument('--workers', type=int, default=4)
+    catalog.set_defaults(func=bench_catalog)
+
+    upstream = commands.add_parser('upstream', help='circuit breaker, deadlines and rate limiting against a faulty upstream')
+    upstream.add_argument('--requests', type=int, default=40)
+    upstream.add_argument('--workers', type=int, default=8)
+    upstream.add_argument('--hang', type=float, default=2.0, help='seconds the hanging upstream takes to answer')
+    upstream.add_argument('--deadline', type=float, default=0.5, help='PAGE_DEADLINE_SECONDS for the run')
+    upstream.add_argument('--rate', type=float, default=20.0, help='token bucket requests/second')
+    upstream.add_argument('--burst', type=int, default=5)
+    upstream.set_defaults(func=bench_upstream)
+
+    worker = commands.add_parser('_catalog-worker')
+    worker.add_argument('mode', choices=('dicts', 'compact'))
+    worker.set_defaults(func=catalog_worker)
+
+    worker = commands.add_parser('_sitemap-worker')
+    worker.add_argument('mode', choices=('legacy', 'streaming'))
+    worker.add_argument('url')
+    worker.set_defaults(func=sitemap_worker)
+
+    args = parser.parse_args(argv)
+    return 0 if args.func(args) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,12 +1,42 @@
 # --- START OF FINAL CORRECTED FILE food.py ---
 
 import requests
+from requests.adapters import HTTPAdapter
 import xml.etree.ElementTree as ET
-from flask import Flask, render_template_string, request, jsonify
+from flask import Blueprint, Flask, Response, current_app, g, redirect, request, jsonify, send_file
+from jinja2.filters import do_title
 from bs4 import BeautifulSoup
+from bs4.dammit import EncodingDetector
+from lxml import etree
 import sys
-import traceback
+import os
+import argparse
+import json
+import logging
+import time
+import sqlite3
+import threading
+import glob
+import gzip
+import hashlib
+import io
+import mmap
+import struct
+import unicodedata
+import zlib
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from functools import lru_cache
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
+from urllib.parse import urlsplit
 import re # Import regex for cleaning text
+try: import brotli # Optional: adds a Brotli variant of the pre-rendered home page
+except ImportError: brotli = None
+try: from PIL import Image, ImageOps, features as pil_features # Optional: /img/<id> thumbnails (else redirects to the originals)
+except ImportError: Image = None
 
 # --- Configuration ---
 SITEMAP_URLS = [
@@ -16,175 +46,2437 @@ SITEMAP_URLS = [
 HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
 }
+# Local SQLite file holding the parsed sitemap catalog
+RECIPES_DB_PATH = os.environ.get('RECIPES_DB_PATH', 'recipes.db')
+# How long a stored sitemap is considered fresh before a background refresh is triggered
+CATALOG_TTL_SECONDS = int(os.environ.get('CATALOG_TTL_SECONDS', 6 * 3600))
+# Outbound HTTP: keep-alive pool size, concurrent requests allowed per upstream host, retries on 5xx/timeouts
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 16))
+HTTP_MAX_PER_HOST = int(os.environ.get('HTTP_MAX_PER_HOST', 4))
+HTTP_RETRIES = int(os.environ.get('HTTP_RETRIES', 3))
+HTTP_BACKOFF_FACTOR = float(os.environ.get('HTTP_BACKOFF_FACTOR', 0.5))
+# Upstream protection: per-host request rate (token bucket, burst size), consecutive failures that
+# open a host's circuit breaker and how long it then fails fast, total time budget of one recipe
+# page or image fetch and of one sitemap download (connect, retries and body included)
+UPSTREAM_RATE = float(os.environ.get('UPSTREAM_RATE', 10))
+UPSTREAM_BURST = int(os.environ.get('UPSTREAM_BURST', 20))
+BREAKER_FAILURES = int(os.environ.get('BREAKER_FAILURES', 5))
+BREAKER_COOLDOWN_SECONDS = float(os.environ.get('BREAKER_COOLDOWN_SECONDS', 30))
+PAGE_DEADLINE_SECONDS = float(os.environ.get('PAGE_DEADLINE_SECONDS', 15))
+SITEMAP_DEADLINE_SECONDS = float(os.environ.get('SITEMAP_DEADLINE_SECONDS', 60))
+# Scraped recipe details: in-process LRU bounds, freshness TTL and how long stale data may still be served
+DETAIL_CACHE_MAX_ENTRIES = int(os.environ.get('DETAIL_CACHE_MAX_ENTRIES', 2000))
+DETAIL_CACHE_MAX_BYTES = int(os.environ.get('DETAIL_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+DETAIL_CACHE_TTL_SECONDS = int(os.environ.get('DETAIL_CACHE_TTL_SECONDS', 7 * 24 * 3600))
+DETAIL_CACHE_STALE_SECONDS = int(os.environ.get('DETAIL_CACHE_STALE_SECONDS', 30 * 24 * 3600))
+# HTML extraction backend for recipe pages: 'lxml' (precompiled XPath) or 'soup' (BeautifulSoup)
+RECIPE_EXTRACTOR = os.environ.get('RECIPE_EXTRACTOR', 'lxml')
+# Web server: dev server (`python food5.py`) and production mode (`python food5.py serve`)
+APP_HOST = os.environ.get('APP_HOST', '127.0.0.1')
+APP_PORT = int(os.environ.get('APP_PORT', 5200))
+APP_DEBUG = os.environ.get('APP_DEBUG', '1').lower() in ('1', 'true', 'yes')  # Dev server only
+APP_WORKERS = int(os.environ.get('APP_WORKERS', (os.cpu_count() or 1) * 2 + 1))
+APP_THREADS = int(os.environ.get('APP_THREADS', 32))
+APP_WORKER_CLASS = os.environ.get('APP_WORKER_CLASS', 'gthread')  # 'gevent' for very high concurrency
+# Recipe scrapes run on their own bounded pool; a request waits at most DETAIL_WAIT_SECONDS for one
+SCRAPE_CONCURRENCY = int(os.environ.get('SCRAPE_CONCURRENCY', 8))
+DETAIL_WAIT_SECONDS = float(os.environ.get('DETAIL_WAIT_SECONDS', 5))
+DETAIL_BATCH_MAX = int(os.environ.get('DETAIL_BATCH_MAX', 48))  # Recipes per /api/recipes/details request
+# Recipe image thumbnails (/img/<id>): disk cache location and size bound, thumbnail size
+# (card size at 2x), how long a failed source image is not retried, browser cache lifetime,
+# size of the pool that downloads and resizes missing ones and how long a request waits for it
+IMAGE_CACHE_DIR = os.path.abspath(os.environ.get('IMAGE_CACHE_DIR', 'image_cache'))  # send_file() resolves relative paths against the app, not the cwd
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get('IMAGE_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+THUMBNAIL_SIZE = tuple(int(v) for v in os.environ.get('THUMBNAIL_SIZE', '560x360').split('x'))
+IMAGE_FAILURE_TTL_SECONDS = int(os.environ.get('IMAGE_FAILURE_TTL_SECONDS', 24 * 3600))
+IMAGE_MAX_AGE_SECONDS = int(os.environ.get('IMAGE_MAX_AGE_SECONDS', 30 * 24 * 3600))
+THUMBNAIL_CONCURRENCY = int(os.environ.get('THUMBNAIL_CONCURRENCY', 4))
+IMAGE_WAIT_SECONDS = float(os.environ.get('IMAGE_WAIT_SECONDS', 1.5))
+# Log verbosity ('DEBUG' traces every extraction step) and per-response Server-Timing header (stage durations)
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '0').lower() in ('1', 'true', 'yes')
+# Number of recipes per page on the home page and default page size of /api/search
+SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', 48))
+# Bulk crawler defaults (`python food5.py crawl`): worker threads and politeness limit in pages/second
+CRAWL_WORKERS = int(os.environ.get('CRAWL_WORKERS', 4))
+CRAWL_RATE = float(os.environ.get('CRAWL_RATE', 2.0))
+# cuisineaz.com gives every recipe's quantities for this many people; `servings=` rescales them
+RECIPE_SERVINGS = int(os.environ.get('RECIPE_SERVINGS', 6))
+SHOPPING_LIST_MAX_RECIPES = int(os.environ.get('SHOPPING_LIST_MAX_RECIPES', 500))
 
 # --- Flask App Initialization ---
-app = Flask(__name__)
+# Routes are registered on a blueprint; create_app() (end of file) builds the Flask app
+# around it, so WSGI servers can create one app per worker process.
+routes = Blueprint('recipes', __name__)
+log = logging.getLogger('food5')
+log.setLevel(LOG_LEVEL)
+
+# --- Instrumentation (Prometheus metrics + Server-Timing) ---
+# Hot-path stages are timed into one histogram (`food5_stage_seconds{stage=...}`) served on
+# /metrics. While a request is handled, the same durations are collected for its
+# Server-Timing header (see SERVER_TIMING); the list lives in a ContextVar so scrapes
+# submitted to the scrape pool still report to the request that started them.
+METRICS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_request_timings = ContextVar('request_timings', default=None)
+
+class Metrics:
+    """Thread-safe counters and histograms, rendered in the Prometheus text format.
+
+    Values are per process: with several gunicorn workers each one serves its own.
+    """
+
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._help = {}        # name -> (type, help text)
+        self._counters = {}    # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [count per bucket..., +Inf count, sum]
+
+    def describe(self, name, kind, text):
+        self._help[name] = (kind, text)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def value(self, name, **labels):
+        """Current value of a counter (0 if it was never incremented)."""
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            histogram[bisect_left(self.buckets, value)] += 1
+            histogram[-1] += value
+
+    def render(self, extra_samples=()):
+        """Prometheus text exposition of every metric. `extra_samples`: more ((name, labels), value) pairs."""
+        with self._lock:
+            counters = list(self._counters.items()) + list(extra_samples)
+            histograms = [(key, list(values)) for key, values in self._histograms.items()]
+        samples = {}
+        for (name, labels), value in counters:
+            samples.setdefault(name, []).append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), histogram in histograms:
+            lines = samples.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), histogram):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram[-1]:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+        output = []
+        for name in sorted(samples):
+            kind, text = self._help.get(name, ('untyped', ''))
+            output += [f"# HELP {name} {text}", f"# TYPE {name} {kind}"] + samples[name]
+        return '\n'.join(output) + '\n'
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape_label(value)}"' for key, value in labels) + '}'
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+METRICS = Metrics()
+METRICS.describe('food5_stage_seconds', 'histogram', 'Duration of hot-path stages (upstream fetch, parse, extraction, render...).')
+METRICS.describe('food5_request_seconds', 'histogram', 'HTTP request duration by endpoint.')
+METRICS.describe('food5_requests_total', 'counter', 'HTTP requests by endpoint and status code.')
+METRICS.describe('food5_upstream_bytes_total', 'counter', 'Bytes downloaded from upstream, by kind (recipe page, sitemap or image).')
+METRICS.describe('food5_extractor_fallback_total', 'counter', 'Recipe pages where a fallback selector path was used.')
+METRICS.describe('food5_extraction_empty_total', 'counter', 'Scraped recipe pages where no ingredients or no steps were found.')
+METRICS.describe('food5_detail_cache_events_total', 'counter', 'Recipe detail cache hits, misses, evictions...')
+METRICS.describe('food5_detail_batch_items_total', 'counter', 'Recipes requested from /api/recipes/details, by result (hit, scraped, pending, unknown).')
+METRICS.describe('food5_image_cache_total', 'counter', 'Thumbnail requests by result (hit, miss, negative).')
+METRICS.describe('food5_upstream_retries_total', 'counter', 'Upstream requests retried after a connection error, timeout or 429/5xx answer, by host.')
+METRICS.describe('food5_upstream_rejected_total', 'counter', 'Upstream requests not sent, by host and reason (circuit_open, rate_limit, no_slot).')
+METRICS.describe('food5_upstream_breaker_state', 'gauge', 'Circuit breaker state per upstream host: 0 closed, 1 half-open, 2 open.')
+METRICS.describe('food5_upstream_breaker_opens_total', 'counter', 'Times the circuit breaker of an upstream host opened.')
+METRICS.describe('food5_upstream_consecutive_failures', 'gauge', 'Failed upstream requests in a row, per host.')
+METRICS.describe('food5_upstream_rate', 'gauge', 'Current request rate limit per upstream host (requests/second, lowered after 429/503).')
+METRICS.describe('food5_detail_cache_entries', 'gauge', 'Recipes held in the in-memory detail cache.')
+METRICS.describe('food5_detail_cache_bytes', 'gauge', 'Approximate size of the in-memory detail cache.')
+
+def record_stage(stage, seconds):
+    """Adds one stage duration to the stage histogram and to the current request's Server-Timing."""
+    METRICS.observe('food5_stage_seconds', seconds, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((stage, seconds))
+
+
+@contextmanager
+def timed(stage):
+    """Times the enclosed block as `stage` (see record_stage())."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+# --- Shared HTTP Fetch Layer ---
+# One pooled session for every outbound request (sitemaps, recipe pages, images), so
+# connections to cuisineaz.com are reused instead of re-opened for each call. Every
+# request also goes through its host's token bucket and circuit breaker, and runs
+# against the deadline of the fetch it belongs to: a slow or dead upstream costs each
+# caller at most its time budget, then nothing at all while the breaker is open.
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+RETRY_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.ChunkedEncodingError)
+
+def build_http_session():
+    """Creates a keep-alive requests.Session (retries are done by upstream_request(), within the deadline)."""
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=0)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+HTTP_SESSION = build_http_session()
+
+
+class UpstreamUnavailable(requests.exceptions.ConnectionError):
+    """Raised without any network I/O while the circuit breaker of a host is open."""
+
+    def __init__(self, host, retry_after):
+        super().__init__(f"{host} is unavailable (circuit open), retrying in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """The time budget of the current fetch ran out (before or during a request)."""
+
+
+_deadline = ContextVar('deadline', default=None)  # time.monotonic() by which the current fetch must be done
+
+@contextmanager
+def deadline(seconds):
+    """Gives the enclosed fetches at most `seconds` in total (or less, when an outer deadline is sooner)."""
+    outer = _deadline.get()
+    token = _deadline.set(min(outer, time.monotonic() + seconds) if outer is not None else time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def deadline_remaining(default=PAGE_DEADLINE_SECONDS):
+    """Seconds left in the current deadline; DeadlineExceeded when none are left."""
+    expires = _deadline.get()
+    if expires is None:
+        return default
+    remaining = expires - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded("Upstream time budget exhausted")
+    return remaining
+
+
+class TokenBucket:
+    """Rate limiter for one host: `rate` requests/second on average, bursts of up to `burst`.
+
+    Adaptive (AIMD): a 429/503 answer halves the rate, down to 1/20 of the configured
+    one, and every successful request gives 1/20 of it back.
+    """
+
+    def __init__(self, rate, burst):
+        self.max_rate = self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Takes a token; returns how many seconds the caller has to wait before using it."""
+        if self.max_rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate) - 1
+            self._updated = now
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def throttle(self):
+        with self._lock:
+            self.rate = max(self.max_rate / 20, self.rate / 2)
+
+    def recover(self):
+        if self.rate < self.max_rate:
+            with self._lock:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class CircuitBreaker:
+    """Fails fast for `cooldown` seconds once a host failed `failures` times in a row.
+
+    Failures are request errors (connection, timeout, truncated or undecodable body...)
+    and 429/5xx answers. After the cooldown a single trial request goes through
+    (half-open): it closes the breaker on success and re-opens it on failure. A trial
+    that ends any other way must call abandon(), or no request would be let through again.
+    """
+    STATES = ('closed', 'half_open', 'open')
+
+    def __init__(self, failures, cooldown):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self._trial_thread = None  # Thread sending the half-open trial request
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """True when a request may be sent now."""
+        with self._lock:
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = 'half_open'
+            if self.state == 'half_open':
+                if self._trial_thread is not None:
+                    return False
+                self._trial_thread = threading.get_ident()
+                return True
+            return self.state == 'closed'
+
+    def retry_after(self):
+        return max(0.0, self.opened_at + self.cooldown - time.monotonic())
+
+    def abandon(self):
+        """The request allowed by allow() on this thread ended without a verdict (not sent, interrupted...)."""
+        with self._lock:
+            if self._trial_thread == threading.get_ident():
+                self._trial_thread = None
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.consecutive_failures = 0
+            self._trial_thread = None
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._trial_thread = None
+            if self.state == 'half_open' or (self.state == 'closed' and self.consecutive_failures >= self.failures):
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                self.opens += 1
+                log.warning("Circuit breaker opened after %d consecutive upstream failures", self.consecutive_failures)
+
+
+class UpstreamHost:
+    """Per-host protection state: concurrency slots, token bucket and circuit breaker."""
+
+    def __init__(self, host):
+        self.host = host
+        self.slots = threading.BoundedSemaphore(HTTP_MAX_PER_HOST)
+        self.bucket = TokenBucket(UPSTREAM_RATE, UPSTREAM_BURST)
+        self.breaker = CircuitBreaker(BREAKER_FAILURES, BREAKER_COOLDOWN_SECONDS)
+
+
+_upstream_hosts = {}
+_upstream_hosts_lock = threading.Lock()
+
+def upstream_host(url):
+    """Returns the protection state of the host of `url`."""
+    host = urlsplit(url).netloc
+    with _upstream_hosts_lock:
+        state = _upstream_hosts.get(host)
+        if state is None:
+            state = _upstream_hosts[host] = UpstreamHost(host)
+    return state
+
+
+def _retry_after_seconds(response):
+    value = response.headers.get('Retry-After', '')
+    return float(value) if value.isdigit() else None
+
+
+def upstream_request(url, headers=None, stream=False):
+    """GET with retries, through the host's breaker and token bucket, within the current deadline.
+
+    Retries connection errors, timeouts, truncated bodies and 429/5xx answers HTTP_RETRIES times with
+    exponential backoff (or the server's Retry-After), as long as the deadline allows.
+    The final 429/5xx response is returned for raise_for_status() to report. Raises
+    UpstreamUnavailable while the breaker is open and DeadlineExceeded when the budget
+    runs out.
+    """
+    upstream = upstream_host(url)
+    breaker, bucket = upstream.breaker, upstream.bucket
+    for attempt in range(HTTP_RETRIES + 1):
+        remaining = deadline_remaining()
+        if not breaker.allow():
+            METRICS.inc('food5_upstream_rejected_total', host=upstream.host, reason='circuit_open')
+            raise UpstreamUnavailable(upstream.host, breaker.retry_after())
+        try:
+            wait = bucket.reserve()
+            if wait >= remaining:
+                METRICS.inc('food5_upstream_rejected_total', host=upstream.host, reason='rate_limit')
+                raise DeadlineExceeded(f"Rate limit for {upstream.host} leaves no time before the deadline")
+            if wait:
+                time.sleep(wait)
+            try:
+                response = HTTP_SESSION.get(url, headers=headers, timeout=remaining - wait, stream=stream)
+            except requests.exceptions.RequestException as e:
+                breaker.record_failure()
+                if not isinstance(e, RETRY_ERRORS):
+                    raise  # Too many redirects, undecodable body...: retrying would not help
+                failure, backoff = e, None
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    breaker.record_success()
+                    bucket.recover()
+                    return response
+                breaker.record_failure()
+                if response.status_code in (429, 503):
+                    bucket.throttle()
+                failure, backoff = response, _retry_after_seconds(response)
+        finally:
+            breaker.abandon()  # No-op once recorded; frees the half-open trial on any other exit
+        if backoff is None:
+            backoff = HTTP_BACKOFF_FACTOR * 2 ** attempt
+        expires = _deadline.get()
+        if attempt == HTTP_RETRIES or (expires is not None and time.monotonic() + backoff >= expires):
+            if isinstance(failure, Exception):
+                raise failure
+            return failure
+        if not isinstance(failure, Exception):
+            failure.close()
+        METRICS.inc('food5_upstream_retries_total', host=upstream.host)
+        time.sleep(backoff)
+
+
+@contextmanager
+def host_slot(url):
+    """Holds one of the HTTP_MAX_PER_HOST request slots of the host of `url`, waiting at most until the deadline."""
+    upstream = upstream_host(url)
+    if not upstream.slots.acquire(timeout=deadline_remaining()):
+        METRICS.inc('food5_upstream_rejected_total', host=upstream.host, reason='no_slot')
+        raise DeadlineExceeded(f"No free connection slot for {upstream.host} before the deadline")
+    try:
+        yield
+    finally:
+        upstream.slots.release()
+
+
+def http_get(url, headers=None):
+    """GET through the shared session and upstream protection, with at most HTTP_MAX_PER_HOST requests in flight per host."""
+    with host_slot(url):
+        return upstream_request(url, headers)
+
+
+@contextmanager
+def http_stream(url, headers=None):
+    """Streaming variant of http_get(): the body is read through iter_body().
+
+    The host slot is held until the block exits, i.e. for the whole download. The
+    headers already counted as a success for the host's breaker: a body that fails to
+    download (truncated, reset, too slow) is recorded as a failure too.
+    """
+    with host_slot(url):
+        response = upstream_request(url, headers, stream=True)
+        try:
+            yield response
+        except requests.exceptions.RequestException:
+            upstream_host(url).breaker.record_failure()
+            raise
+        finally:
+            response.close()
+
+
+def iter_body(response, chunk_size):
+    """response.iter_content() that raises DeadlineExceeded when the download outlives the deadline."""
+    for chunk in response.iter_content(chunk_size):
+        deadline_remaining()
+        yield chunk
+
+
+def upstream_samples():
+    """/metrics samples describing the breaker and token bucket of every upstream host."""
+    with _upstream_hosts_lock:
+        hosts = list(_upstream_hosts.values())
+    samples = []
+    for upstream in hosts:
+        labels = (('host', upstream.host),)
+        samples += [(('food5_upstream_breaker_state', labels), CircuitBreaker.STATES.index(upstream.breaker.state)),
+                    (('food5_upstream_breaker_opens_total', labels), upstream.breaker.opens),
+                    (('food5_upstream_consecutive_failures', labels), upstream.breaker.consecutive_failures),
+                    (('food5_upstream_rate', labels), round(upstream.bucket.rate, 3))]
+    return samples
+
+
+def fetch_parallel(func, items):
+    """Calls `func` on every item concurrently and returns the results in order (within the caller's deadline)."""
+    items = list(items)
+    if len(items) <= 1:
+        return [func(item) for item in items]
+    context = copy_context()
+    with ThreadPoolExecutor(max_workers=min(len(items), HTTP_POOL_SIZE)) as executor:
+        return list(executor.map(lambda item: context.copy().run(func, item), items))
+
 
 # --- XML Parsing Logic (Sitemap) ---
-# (Using the version from your provided file)
-def fetch_and_parse_recipes(url):
-    """Fetches a SINGLE XML sitemap and parses recipe URLs and images."""
-    recipes = []
+SITEMAP_NAMESPACES = {
+    'sitemap': 'http://www.sitemaps.org/schemas/sitemap/0.9',
+    'image': 'http://www.google.com/schemas/sitemap-image/1.1'
+}
+SITEMAP_CHUNK_SIZE = 64 * 1024
+_URL_TAG = '{%s}url' % SITEMAP_NAMESPACES['sitemap']
+_SITEMAP_TAG = '{%s}sitemap' % SITEMAP_NAMESPACES['sitemap']
+_GZIP_MAGIC = b'\x1f\x8b'
+
+def iter_sitemap_xml(chunks):
+    """Incrementally parses sitemap XML from an iterable of byte chunks.
+
+    Yields {'url', 'image_url', 'lastmod'} for every <url> entry and {'sitemap': loc} for every
+    <sitemapindex> entry, as soon as each element is complete. Finished elements are
+    cleared so memory stays flat, and gzip-compressed input (.xml.gz) is detected and
+    decompressed on the fly.
+    """
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    decompressor = None
+    started = False
+    root = None
+
+    def drain():
+        nonlocal root
+        for event, element in parser.read_events():
+            if event == 'start':
+                if root is None: root = element
+                continue
+            if element.tag == _URL_TAG:
+                loc_element = element.find('sitemap:loc', SITEMAP_NAMESPACES)
+                image_loc_element = element.find('image:image/image:loc', SITEMAP_NAMESPACES)
+                lastmod_element = element.find('sitemap:lastmod', SITEMAP_NAMESPACES)
+                recipe_url = loc_element.text if loc_element is not None else None
+                image_url = image_loc_element.text if image_loc_element is not None else None
+                lastmod = lastmod_element.text.strip() if lastmod_element is not None and lastmod_element.text else None
+                if recipe_url:
+                    yield {'url': recipe_url, 'image_url': image_url, 'lastmod': lastmod}
+            elif element.tag == _SITEMAP_TAG:
+                loc_element = element.find('sitemap:loc', SITEMAP_NAMESPACES)
+                if loc_element is not None and loc_element.text:
+                    yield {'sitemap': loc_element.text.strip()}
+            else:
+                continue
+            root.clear()  # Drop the entries already handed out
+
+    for chunk in chunks:
+        if not chunk: continue
+        if not started:
+            started = True
+            if chunk[:2] == _GZIP_MAGIC:
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        parser.feed(decompressor.decompress(chunk) if decompressor else chunk)
+        yield from drain()
+    if decompressor:
+        parser.feed(decompressor.flush())
+    parser.close()
+    yield from drain()
+
+
+def measure_chunks(chunks, stats):
+    """Passes download chunks through, adding their size and the time spent waiting for them to `stats`."""
+    chunks = iter(chunks)
+    while True:
+        start = time.perf_counter()
+        chunk = next(chunks, None)
+        stats['network'] += time.perf_counter() - start
+        if chunk is None:
+            return
+        stats['bytes'] += len(chunk)
+        yield chunk
+
+
+def parse_sitemap_xml(xml_content):
+    """Parses complete sitemap XML bytes into (recipes, child_sitemaps)."""
+    recipes, child_sitemaps = [], []
+    for item in iter_sitemap_xml([xml_content]):
+        if 'sitemap' in item: child_sitemaps.append(item['sitemap'])
+        else: recipes.append(item)
+    return recipes, child_sitemaps
+
+
+def iter_sitemap_recipes(url, seconds=SITEMAP_DEADLINE_SECONDS):
+    """Yields the recipe records of a sitemap while it downloads, recursing into <sitemapindex> children.
+
+    Each sitemap must be downloaded within `seconds`.
+    """
+    child_sitemaps = []
+    with deadline(seconds), http_stream(url) as response:
+        response.raise_for_status()
+        for item in iter_sitemap_xml(iter_body(response, SITEMAP_CHUNK_SIZE)):
+            if 'sitemap' in item: child_sitemaps.append(item['sitemap'])
+            else: yield item
+    for child_url in child_sitemaps:
+        yield from iter_sitemap_recipes(child_url, seconds)
+
+
+def fetch_sitemap(url, etag=None, last_modified=None):
+    """Conditionally fetches a SINGLE XML sitemap, parsing it while it downloads.
+
+    Returns (recipes, validators, error_message). `recipes` is None when the
+    server answered 304 Not Modified for the given ETag / Last-Modified.
+    """
+    recipes = None
+    validators = {'etag': etag, 'last_modified': last_modified}
     error_message = None
-    # print(f"Attempting to fetch sitemap: {url}") # Less verbose
+    request_headers = {}
+    if etag: request_headers['If-None-Match'] = etag
+    if last_modified: request_headers['If-Modified-Since'] = last_modified
     try:
-        response = requests.get(url, headers=HEADERS, timeout=25)
-        # print(f"Sitemap status code: {response.status_code}") # Less verbose
-        response.raise_for_status()
-        namespaces = {
-            'sitemap': 'http://www.sitemaps.org/schemas/sitemap/0.9',
-            'image': 'http://www.google.com/schemas/sitemap-image/1.1'
-        }
-        xml_content = response.content
-        root = ET.fromstring(xml_content)
-        url_elements = root.findall('sitemap:url', namespaces)
-        for url_element in url_elements:
-            loc_element = url_element.find('sitemap:loc', namespaces)
-            image_element = url_element.find('image:image', namespaces)
-            image_loc_element = image_element.find('image:loc', namespaces) if image_element is not None else None
-            recipe_url = loc_element.text if loc_element is not None else None
-            image_url = image_loc_element.text if image_loc_element is not None else None
-            if recipe_url:
-                recipes.append({'url': recipe_url, 'image_url': image_url})
+        with deadline(SITEMAP_DEADLINE_SECONDS), http_stream(url, headers=request_headers) as response:
+            if response.status_code == 304:
+                return None, validators, None
+            response.raise_for_status()
+            validators = {'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified')}
+            recipes, child_sitemaps = [], []
+            # Parsing is interleaved with the download: time spent waiting for chunks is the fetch, the rest is parsing
+            stats = {'network': 0.0, 'bytes': 0}
+            start = time.perf_counter()
+            for item in iter_sitemap_xml(measure_chunks(iter_body(response, SITEMAP_CHUNK_SIZE), stats)):
+                if 'sitemap' in item: child_sitemaps.append(item['sitemap'])
+                else: recipes.append(item)
+            record_stage('sitemap_fetch', stats['network'])
+            record_stage('sitemap_parse', time.perf_counter() - start - stats['network'])
+            METRICS.inc('food5_upstream_bytes_total', stats['bytes'], kind='sitemap')
+        if child_sitemaps:
+            # <sitemapindex>: fetch every child sitemap concurrently (unconditionally) and merge them
+            for child_recipes, _, child_error in fetch_parallel(fetch_sitemap, child_sitemaps):
+                recipes.extend(child_recipes or [])
+                if child_error:
+                    error_message = child_error
     except requests.exceptions.RequestException as e:
         error_message = f"Network error fetching sitemap {url.split('/')[-1]}: {e}"
-        print(f"ERROR: {error_message}")
+        log.error(error_message)
     except ET.ParseError as e:
         error_message = f"Error parsing XML sitemap {url.split('/')[-1]}. Error: {e}"
-        print(f"ERROR: {error_message}")
+        log.error(error_message)
     except Exception as e:
         error_message = f"Unexpected error processing sitemap {url.split('/')[-1]}: {e}"
-        print(f"UNEXPECTED ERROR:")
-        traceback.print_exc()
-    return recipes, error_message
+        log.exception(error_message)
+    return recipes, validators, error_message
+
+
+def fetch_and_parse_recipes(url):
+    """Fetches a SINGLE XML sitemap and parses recipe URLs and images."""
+    recipes, _, error_message = fetch_sitemap(url)
+    return recipes or [], error_message
+
+
+# --- Sitemap Catalog (persistent, refreshed in the background) ---
+# The parsed sitemap records live in SQLite so that `/` never waits on cuisineaz.com:
+# a cold process serves the last known catalog and a stale one is refreshed in a
+# background thread using ETag / If-Modified-Since.
+_db_local = threading.local()
+_catalog_refresh_lock = threading.Lock()
+_catalog_cache = {'version': None, 'recipes': [], 'errors': []}
+
+def get_db():
+    """Returns this thread's SQLite connection to the recipe database, creating the schema on first use."""
+    conn = getattr(_db_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(RECIPES_DB_PATH, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS sitemaps (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL,
+                error TEXT
+            );
+            CREATE TABLE IF NOT EXISTS recipes (
+                id INTEGER PRIMARY KEY,
+                url TEXT NOT NULL UNIQUE,
+                image_url TEXT,
+                sitemap_url TEXT,
+                sitemap_rank INTEGER,
+                position INTEGER,
+                lastmod TEXT
+            );
+            CREATE INDEX IF NOT EXISTS recipes_order ON recipes (sitemap_rank, position);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS recipe_details (
+                url TEXT PRIMARY KEY,
+                details TEXT NOT NULL,
+                warning TEXT,
+                fetched_at REAL NOT NULL,
+                lastmod TEXT,
+                content_hash TEXT
+            );
+            CREATE TABLE IF NOT EXISTS details_changes (version INTEGER NOT NULL, url TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS details_changes_version ON details_changes (version);
+            CREATE TABLE IF NOT EXISTS thumbnails (
+                recipe_id INTEGER PRIMARY KEY,
+                source_url TEXT NOT NULL,
+                bytes INTEGER NOT NULL DEFAULT 0,
+                accessed_at REAL,
+                failed_at REAL,
+                error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS thumbnails_lru ON thumbnails (accessed_at);
+        """)
+        # Columns added to databases created by earlier versions
+        for table, column in (('recipes', 'lastmod'), ('recipe_details', 'lastmod'), ('recipe_details', 'content_hash')):
+            if column not in {row['name'] for row in conn.execute(f'PRAGMA table_info({table})')}:
+                try:
+                    conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} TEXT')
+                except sqlite3.OperationalError:
+                    pass  # Added concurrently by another worker
+        # Random id of this database, part of the snapshot file names: a recreated database
+        # restarts its catalog versions at 1 and must not pick up the old database's snapshots
+        with conn:
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('database_id', ?)", (os.urandom(8).hex(),))
+        _db_local.conn = conn
+    return conn
+
+
+def get_catalog_version(conn=None):
+    """Returns the catalog version counter, bumped every time the stored recipe list changes."""
+    conn = conn or get_db()
+    row = conn.execute("SELECT value FROM meta WHERE key = 'catalog_version'").fetchone()
+    return int(row['value']) if row else 0
+
+
+def get_details_version(conn=None):
+    """Returns the details version counter, bumped every time stored recipe details change or expire.
+
+    Other processes (crawler, sync, other workers) share the database but not the
+    memory tier of the detail cache nor the indexes: they compare this counter on
+    every use to notice changes they did not make themselves.
+    """
+    conn = conn or get_db()
+    row = conn.execute("SELECT value FROM meta WHERE key = 'details_version'").fetchone()
+    return int(row['value']) if row else 0
+
+
+# Versions kept in the details_changes log. A process that fell further behind (idle for
+# a long crawl) drops its whole memory tier instead of the changed URLs only.
+DETAILS_CHANGES_KEPT = 10000
+
+def bump_details_version(conn, urls):
+    """Increments the details version inside the caller's transaction and returns the new value.
+
+    The changed `urls` are logged under the new version in `details_changes`, so that other
+    processes only drop those from their memory tier (see DetailCache._sync()).
+    """
+    conn.execute("""
+        INSERT INTO meta (key, value) VALUES ('details_version', '1')
+        ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1
+    """)
+    version = get_details_version(conn)
+    conn.executemany("INSERT INTO details_changes (version, url) VALUES (?, ?)", [(version, url) for url in urls])
+    conn.execute("DELETE FROM details_changes WHERE version <= ?", (version - DETAILS_CHANGES_KEPT,))
+    return version
+
+
+def get_details_changes(since, until, conn=None):
+    """URLs whose stored details changed in versions (since, until], or None when the log no longer covers them all."""
+    conn = conn or get_db()
+    versions, urls = set(), set()
+    for row in conn.execute("SELECT version, url FROM details_changes WHERE version > ? AND version <= ?", (since, until)):
+        versions.add(row['version'])
+        urls.add(row['url'])
+    return urls if len(versions) == until - since else None
+
+
+def store_sitemap_recipes(conn, sitemap_url, recipes, validators):
+    """Applies one fetched sitemap to the catalog as a delta against its stored rows.
+
+    Only added, moved or re-imaged recipes are written, ids stay stable for URLs already
+    known, and the catalog version (hence the snapshot and the indexes) is only bumped
+    when the recipe list itself changed. Returns {'added', 'removed', 'changed'} lists of
+    URLs, `changed` being the recipes whose <lastmod> moved since the last fetch.
+    """
+    rank = SITEMAP_URLS.index(sitemap_url) if sitemap_url in SITEMAP_URLS else len(SITEMAP_URLS)
+    stored = {row['url']: (row['image_url'], row['sitemap_rank'], row['position'], row['lastmod'])
+              for row in conn.execute("SELECT url, image_url, sitemap_rank, position, lastmod FROM recipes "
+                                      "WHERE sitemap_url = ?", (sitemap_url,))}
+    delta = {'added': [], 'removed': [], 'changed': []}
+    upserts, lastmod_updates, baselines = [], [], []
+    seen_hashes = set()  # 64-bit URL hashes instead of a second copy of every URL string
+    for position, recipe in enumerate(recipes):
+        key = url_hash(recipe['url'])
+        if key in seen_hashes:
+            continue
+        seen_hashes.add(key)
+        url, lastmod = recipe['url'], recipe.get('lastmod')
+        previous = stored.pop(url, None)
+        if previous is None or previous[:3] != (recipe['image_url'], rank, position):
+            upserts.append(((url, recipe['image_url'], sitemap_url, rank, position, lastmod), previous is None))
+        elif lastmod != previous[3]:
+            lastmod_updates.append((lastmod, url))
+        if previous is not None and lastmod != previous[3]:
+            if previous[3] is None:
+                baselines.append((lastmod, url))  # First <lastmod> seen: assume stored details match it
+            elif lastmod is not None:
+                delta['changed'].append(url)
+    delta['removed'] = list(stored)  # No longer listed in this sitemap
+    layout_changed = bool(delta['removed'])
+    with conn:
+        # A URL listed in several sitemaps belongs to the first one (same dedup order as before)
+        for row, is_new in upserts:
+            before = conn.total_changes
+            conn.execute("""
+                INSERT INTO recipes (url, image_url, sitemap_url, sitemap_rank, position, lastmod)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(url) DO UPDATE SET
+                    image_url = excluded.image_url, sitemap_url = excluded.sitemap_url,
+                    sitemap_rank = excluded.sitemap_rank, position = excluded.position,
+                    lastmod = excluded.lastmod
+                WHERE excluded.sitemap_rank <= recipes.sitemap_rank OR recipes.sitemap_url = excluded.sitemap_url
+            """, row)
+            if conn.total_changes != before:
+                layout_changed = True
+                if is_new:
+                    delta['added'].append(row[0])
+        conn.executemany("UPDATE recipes SET lastmod = ? WHERE url = ?", lastmod_updates)
+        conn.executemany("UPDATE recipe_details SET lastmod = ? WHERE url = ? AND lastmod IS NULL", baselines)
+        conn.executemany("DELETE FROM recipes WHERE url = ? AND sitemap_url = ?",
+                         [(url, sitemap_url) for url in delta['removed']])
+        # Scraped details go with their recipe, unless another sitemap still lists it
+        conn.executemany("DELETE FROM recipe_details WHERE url = ? AND url NOT IN (SELECT url FROM recipes)",
+                         [(url,) for url in delta['removed']])
+        conn.execute("""
+            INSERT INTO sitemaps (url, etag, last_modified, fetched_at, error) VALUES (?, ?, ?, ?, NULL)
+            ON CONFLICT(url) DO UPDATE SET etag = excluded.etag, last_modified = excluded.last_modified,
+                fetched_at = excluded.fetched_at, error = NULL
+        """, (sitemap_url, validators.get('etag'), validators.get('last_modified'), time.time()))
+        if layout_changed:
+            conn.execute("""
+                INSERT INTO meta (key, value) VALUES ('catalog_version', '1')
+                ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1
+            """)
+    return delta
+
+
+def save_sitemap_result(conn, sitemap_url, recipes, validators, error_message):
+    """Stores the outcome of fetch_sitemap() for one sitemap in the catalog.
+
+    Returns the delta of store_sitemap_recipes(), or None when the recipe list was not fetched.
+    """
+    # On any error (including a failed child of a sitemap index) the last known recipes are kept
+    if error_message:
+        # Only remember the failure, it is retried after the TTL
+        with conn:
+            conn.execute("""
+                INSERT INTO sitemaps (url, fetched_at, error) VALUES (?, ?, ?)
+                ON CONFLICT(url) DO UPDATE SET fetched_at = excluded.fetched_at, error = excluded.error
+            """, (sitemap_url, time.time(), error_message))
+    elif recipes is None:
+        with conn:
+            conn.execute("UPDATE sitemaps SET fetched_at = ?, error = NULL WHERE url = ?", (time.time(), sitemap_url))
+    else:
+        return store_sitemap_recipes(conn, sitemap_url, recipes, validators)
+
+
+def refresh_catalog(force=False):
+    """Refreshes every sitemap older than CATALOG_TTL_SECONDS (or all of them when `force`).
+
+    Returns the combined {'added', 'removed', 'changed'} delta, or None when another
+    thread is already refreshing.
+    """
+    if not _catalog_refresh_lock.acquire(blocking=False):
+        return None  # Another thread is already refreshing
+    try:
+        conn = get_db()
+        stored = {row['url']: row for row in conn.execute("SELECT url, etag, last_modified, fetched_at FROM sitemaps")}
+        now = time.time()
+        due = [u for u in SITEMAP_URLS
+               if force or u not in stored or stored[u]['fetched_at'] is None
+               or now - stored[u]['fetched_at'] >= CATALOG_TTL_SECONDS]
+
+        def fetch_one(sitemap_url):
+            row = stored.get(sitemap_url)
+            return fetch_sitemap(sitemap_url, row['etag'] if row else None, row['last_modified'] if row else None)
+
+        # Downloads run concurrently; the SQLite writes stay on this thread
+        delta = {'added': [], 'removed': [], 'changed': []}
+        for sitemap_url, (recipes, validators, error_message) in zip(due, fetch_parallel(fetch_one, due)):
+            sitemap_delta = save_sitemap_result(conn, sitemap_url, recipes, validators, error_message)
+            if sitemap_delta:
+                log.info('Sitemap %s: %d added, %d removed, %d changed', sitemap_url,
+                         len(sitemap_delta['added']), len(sitemap_delta['removed']), len(sitemap_delta['changed']))
+                for key, urls in sitemap_delta.items():
+                    delta[key].extend(urls)
+        # Changed pages are served stale until re-scraped, removed ones are simply forgotten
+        DETAIL_CACHE.expire(delta['changed'] + delta['removed'])
+        return delta
+    finally:
+        _catalog_refresh_lock.release()
+
+
+def catalog_is_stale(conn=None):
+    """True when at least one configured sitemap has never been fetched or is past its TTL."""
+    conn = conn or get_db()
+    fetched = {row['url']: row['fetched_at'] for row in conn.execute("SELECT url, fetched_at FROM sitemaps")}
+    now = time.time()
+    return any(fetched.get(u) is None or now - fetched[u] >= CATALOG_TTL_SECONDS for u in SITEMAP_URLS)
+
+
+def schedule_catalog_refresh():
+    """Starts a background refresh if the catalog is stale and no refresh is running."""
+    if _catalog_refresh_lock.locked() or not catalog_is_stale():
+        return
+    threading.Thread(target=refresh_catalog, name='catalog-refresh', daemon=True).start()
+
+
+# --- Compact Catalog Snapshot (memory-mapped, shared by worker processes) ---
+# Each catalog version is written once to `<RECIPES_DB_PATH>.catalog-<database id>-<version>`, a
+# column-oriented file that every worker process maps read-only, so the catalog pages
+# are shared through the OS page cache instead of each worker holding its own dicts.
+# Layout (native byte order, sections 8-byte aligned): header, JSON list of interned URL
+# prefixes, then columns: ids (uint32), URL and image prefix ids (uint16), URL hashes
+# sorted (uint64) with their positions (uint32), offsets (uint32) of URL slugs, image
+# slugs and precomputed titles in a final UTF-8 blob.
+_CATALOG_HEADER = struct.Struct('<8sII')  # magic, recipe count, size of the prefix table
+CATALOG_MAGIC = b'F5CAT001'
+_NO_IMAGE = 0xFFFF
+
+def url_hash(url):
+    """64-bit hash of a URL, for dedup and lookups without keeping URL strings in sets or dicts."""
+    return int.from_bytes(hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def _align(size):
+    return (size + 7) & ~7
+
+
+class CompactCatalog:
+    """Read-only recipe catalog over a buffer in the snapshot format (bytes or mmap).
+
+    Behaves like a list of {'id', 'url', 'image_url', 'title'} dicts, built on access;
+    url(), image_url() and title() read a single column without building the dict.
+    """
+    __slots__ = ('_buffer', '_count', '_prefixes', '_ids', '_url_prefix', '_image_prefix', '_hashes', '_hash_docs',
+                 '_url_offsets', '_image_offsets', '_title_offsets', '_blob')
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+        view = memoryview(buffer)
+        magic, count, prefix_size = _CATALOG_HEADER.unpack_from(view)
+        if magic != CATALOG_MAGIC:
+            raise ValueError("Not a recipe catalog snapshot")
+        position = _align(_CATALOG_HEADER.size)
+        sections = []
+        for size, fmt in ((prefix_size, 'B'), (4 * count, 'I'), (2 * count, 'H'), (2 * count, 'H'), (8 * count, 'Q'),
+                          (4 * count, 'I'), (4 * count + 4, 'I'), (4 * count + 4, 'I'), (4 * count + 4, 'I')):
+            sections.append(view[position:position + size].cast(fmt))
+            position = _align(position + size)
+        self._count = count
+        self._prefixes = json.loads(bytes(sections[0]))
+        (self._ids, self._url_prefix, self._image_prefix, self._hashes, self._hash_docs,
+         self._url_offsets, self._image_offsets, self._title_offsets) = sections[1:]
+        self._blob = view[position:]
+
+    @staticmethod
+    def serialize(records):
+        """Encodes (id, url, image_url) records, in catalog order, into the snapshot format."""
+        prefix_ids = {'': 0}
+        ids, url_prefix, image_prefix, hashes = array('I'), array('H'), array('H'), []
+        columns = [(bytearray(), array('I', [0])) for _ in range(3)]  # URL slugs, image slugs, titles
+
+        def intern(url):
+            cut = url.rfind('/') + 1
+            prefix_id = prefix_ids.setdefault(url[:cut], len(prefix_ids))
+            if prefix_id >= _NO_IMAGE:  # Table full: keep the whole URL as the slug
+                del prefix_ids[url[:cut]]
+                return 0, url
+            return prefix_id, url[cut:]
+
+        for doc, (recipe_id, url, image_url) in enumerate(records):
+            ids.append(recipe_id)
+            hashes.append((url_hash(url), doc))
+            prefix_id, slug = intern(url)
+            url_prefix.append(prefix_id)
+            image_prefix_id, image_slug = intern(image_url) if image_url else (_NO_IMAGE, '')
+            image_prefix.append(image_prefix_id)
+            for (blob, offsets), text in zip(columns, (slug, image_slug, recipe_title(url))):
+                blob += text.encode('utf-8')
+                offsets.append(len(blob))
+        hashes.sort()
+        prefixes = json.dumps(sorted(prefix_ids, key=prefix_ids.get)).encode('utf-8')
+        url_blob, image_blob, title_blob = (blob for blob, _ in columns)
+        # Offsets address the concatenated blob: shift the image slug and title columns
+        shifted = [columns[0][1], array('I', (o + len(url_blob) for o in columns[1][1])),
+                   array('I', (o + len(url_blob) + len(image_blob) for o in columns[2][1]))]
+        parts = [_CATALOG_HEADER.pack(CATALOG_MAGIC, len(ids), len(prefixes)), prefixes, ids.tobytes(),
+                 url_prefix.tobytes(), image_prefix.tobytes(), array('Q', (h for h, _ in hashes)).tobytes(),
+                 array('I', (doc for _, doc in hashes)).tobytes()] + [offsets.tobytes() for offsets in shifted]
+        output = bytearray()
+        for part in parts:
+            output += part
+            output += bytes(_align(len(output)) - len(output))
+        return bytes(output + url_blob + image_blob + title_blob)
+
+    @classmethod
+    def from_records(cls, records):
+        """In-memory catalog (not shared between processes) from (id, url, image_url) records."""
+        return cls(cls.serialize(records))
+
+    def __len__(self):
+        return self._count
+
+    def _text(self, offsets, doc):
+        return str(self._blob[offsets[doc]:offsets[doc + 1]], 'utf-8')
+
+    def url(self, doc):
+        return self._prefixes[self._url_prefix[doc]] + self._text(self._url_offsets, doc)
+
+    def image_url(self, doc):
+        prefix_id = self._image_prefix[doc]
+        return None if prefix_id == _NO_IMAGE else self._prefixes[prefix_id] + self._text(self._image_offsets, doc)
+
+    def title(self, doc):
+        return self._text(self._title_offsets, doc)
+
+    def urls(self):
+        return (self.url(doc) for doc in range(self._count))
+
+    def find(self, url):
+        """Catalog position of `url`, or None (binary search over the sorted URL hashes)."""
+        key = url_hash(url)
+        i = bisect_left(self._hashes, key)
+        while i < self._count and self._hashes[i] == key:
+            if self.url(self._hash_docs[i]) == url:
+                return self._hash_docs[i]
+            i += 1
+        return None
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self[doc] for doc in range(self._count)[key]]
+        doc = range(self._count)[key]
+        return {'id': self._ids[doc], 'url': self.url(doc), 'image_url': self.image_url(doc), 'title': self.title(doc)}
+
+    def __iter__(self):
+        return (self[doc] for doc in range(self._count))
+
+
+def catalog_snapshot_path(conn, version):
+    """File of the snapshot of catalog `version` of this database (see get_db() for the database id)."""
+    database_id = conn.execute("SELECT value FROM meta WHERE key = 'database_id'").fetchone()['value']
+    return f"{RECIPES_DB_PATH}.catalog-{database_id}-{version}"
+
+
+def open_catalog_snapshot(conn, version):
+    """Maps the snapshot of catalog `version`, writing it from SQLite first if no process did yet."""
+    path = catalog_snapshot_path(conn, version)
+    if not os.path.exists(path):
+        rows = conn.execute("SELECT id, url, image_url FROM recipes ORDER BY sitemap_rank, position")
+        data = CompactCatalog.serialize((row['id'], row['url'], row['image_url']) for row in rows)
+        temporary = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        with open(temporary, 'wb') as f:
+            f.write(data)
+        os.replace(temporary, path)  # Atomic: other workers see the whole file or none
+        prefix = path.rsplit('-', 1)[0] + '-'
+        for old_path in glob.glob(f"{glob.escape(RECIPES_DB_PATH)}.catalog-*"):
+            if old_path.endswith('.tmp'):
+                continue  # Being written by another worker
+            old_version = old_path.rsplit('-', 1)[-1]
+            # Keep the previous version for slower workers; snapshots of an older database all go
+            if not old_path.startswith(prefix) or (old_version.isdigit() and int(old_version) < version - 1):
+                try: os.remove(old_path)
+                except OSError: pass  # Still mapped on Windows; removed on a later refresh
+    with open(path, 'rb') as f:
+        return CompactCatalog(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def load_catalog():
+    """Returns (catalog, errors) from the stored catalog, re-mapping the snapshot only when its version changed."""
+    conn = get_db()
+    version = get_catalog_version(conn)
+    if version == 0 and not _catalog_refresh_lock.locked():
+        # Very first start with an empty database: nothing to serve yet, fetch synchronously once
+        refresh_catalog()
+        version = get_catalog_version(conn)
+    errors = [row['error'] for row in conn.execute(
+        "SELECT error FROM sitemaps WHERE error IS NOT NULL ORDER BY url")]
+    if _catalog_cache['version'] != version:
+        _catalog_cache['recipes'] = open_catalog_snapshot(conn, version)
+        _catalog_cache['version'] = version
+    _catalog_cache['errors'] = errors
+    return _catalog_cache['recipes'], errors
 
 
 # --- Recipe Detail Scraping Logic (Ingredient Quantity Targeted) ---
-def scrape_recipe_details(recipe_url):
-    """Fetches and scrapes ingredients (name + quantity) and steps from a single recipe URL."""
+def fetch_recipe_page(recipe_url):
+    """Downloads a single recipe page and returns its raw HTML bytes."""
+    with timed('fetch'), deadline(PAGE_DEADLINE_SECONDS):
+        response = http_get(recipe_url)
+        response.raise_for_status()
+        content = response.content
+    log.debug(" -> Recipe page status code: %s", response.status_code)
+    METRICS.inc('food5_upstream_bytes_total', len(content), kind='recipe')
+    return content
+
+
+def extract_details_soup(html, recipe_url=''):
+    """BeautifulSoup extractor: ingredients (name + quantity) and steps from recipe page HTML."""
     # Stores ingredients as list of dicts: [{'quantity': '...', 'name': '...'}, ...]
     details = {'ingredients': [], 'steps': []}
-    error_message = None
-    print(f"Attempting to scrape recipe details from: {recipe_url}")
-    try:
-        response = requests.get(recipe_url, headers=HEADERS, timeout=15)
-        response.raise_for_status()
-        print(f" -> Recipe page status code: {response.status_code}")
-        soup = BeautifulSoup(response.content, 'lxml')
-
-        # --- Find Ingredients (Targeting specific spans based on HTML snippet) ---
-        details['ingredients'] = [] # Ensure list is empty before scraping
-        ingredients_found = False
-        print("--- Attempting Ingredient Extraction (Targeting Spans) ---")
-
-        # Select the list items using the method assumed to work in your original file
-        # Primarily target li.ingredient_item as shown in your snippet
-        ingredient_list_items = soup.select('li.ingredient_item')
-        # Add fallbacks similar to your original *if necessary*, but prioritize the specific selector
-        if not ingredient_list_items:
-             print("  -> 'li.ingredient_item' not found. Trying 'section.borderSection > li.ingredient'...")
-             ingredients_section = soup.find('section', class_='borderSection')
-             if ingredients_section:
-                 ingredient_list_items = ingredients_section.find_all('li', class_='ingredient')
-        # Add other fallbacks from your original working file if needed here
-
-        print(f"  -> Found {len(ingredient_list_items)} potential ingredient list items.")
-
-        if ingredient_list_items:
-            for i, item in enumerate(ingredient_list_items):
-                # 1. Find the NAME span specifically
-                name_span = item.find('span', class_='ingredient_label')
-                ingredient_name = name_span.get_text(strip=True) if name_span else None
-
-                # 2. Find the QUANTITY span specifically
-                # Use the exact class from your snippet
-                quantity_span = item.find('span', class_='js-ingredient-qte ingredient_qte')
-                quantity_text = quantity_span.get_text(strip=True) if quantity_span else ""
-
-                # 3. Append ONLY if a valid name was found
-                if ingredient_name:
-                    details['ingredients'].append({
-                        'quantity': quantity_text if quantity_text else "-", # Use "-" if quantity missing
-                        'name': ingredient_name
-                    })
-                    ingredients_found = True
-                    # print(f"    -> Added: Qty='{quantity_text if quantity_text else '-'}' Name='{ingredient_name}'") # Debug
-                # else:
-                    # print(f"    -> Warning: Skipping item {i+1}, couldn't find 'span.ingredient_label'.")
-
-            if ingredients_found:
-                 print(f"  -> Successfully parsed {len(details['ingredients'])} ingredients from list items.")
-        else:
-            print("  -> No ingredient list items found using primary selectors.")
-            # If your original script had a global fallback like selecting labels directly, add it here.
-            # Example:
-            # print(" -> Trying direct selection of .ingredient_label as fallback...")
-            # direct_labels = soup.select('.ingredient_label')
-            # ... (add logic to append these with quantity '-') ...
-
-
-        # --- Find Preparation Steps (Using Logic from your provided file) ---
-        print("--- Attempting Step Extraction (Using Original Logic) ---")
-        steps_found = False
-        # Use the selectors confirmed to work from your original file
-        preparation_list_ul = soup.find('ul', class_='preparation_steps')
-        if preparation_list_ul:
-            step_list_items = preparation_list_ul.find_all('li', class_='preparation_step', recursive=False) # Direct children
-            if step_list_items:
-                print(f"  -> Found {len(step_list_items)} preparation step list items (li.preparation_step).")
-                for list_item in step_list_items:
-                    step_paragraph = list_item.find('p') # Find 'p' inside the 'li'
-                    if step_paragraph:
-                        step_text = step_paragraph.get_text(strip=True)
-                        if step_text:
-                            details['steps'].append(step_text)
-                            steps_found = True
-                    # else: print(f"  -> Warning: No <p> tag found within this li.preparation_step.")
-            # else: print(f"  -> Warning: Found ul.preparation_steps, but no li.preparation_step items within it.")
-        # else: print(f"  -> Warning: Could not find the main preparation list (ul.preparation_steps).")
-
-        # Fallback for steps ONLY if primary method found nothing (Keep your original fallback)
-        if not steps_found:
-            preparation_section = soup.find('section', id='preparation')
-            if preparation_section:
-                print(" -> Fallback: Trying any <p> tag inside section#preparation for steps.")
-                fallback_paragraphs = preparation_section.find_all('p')
-                count = 0
-                seen_step_texts = set(details['steps']) # Avoid duplicates
-                for p_tag in fallback_paragraphs:
-                    step_text = p_tag.get_text(strip=True)
-                    # Add a check to avoid adding short/irrelevant text or duplicates
-                    if step_text and len(step_text) > 15 and step_text not in seen_step_texts:
+    with timed('parse'):
+        soup = BeautifulSoup(html, 'lxml')
+
+    # --- Find Ingredients (Targeting specific spans based on HTML snippet) ---
+    details['ingredients'] = [] # Ensure list is empty before scraping
+    ingredients_found = False
+    log.debug("--- Attempting Ingredient Extraction (Targeting Spans) ---")
+    stage_start = time.perf_counter()
+
+    # Select the list items using the method assumed to work in your original file
+    # Primarily target li.ingredient_item as shown in your snippet
+    ingredient_list_items = soup.select('li.ingredient_item')
+    # Add fallbacks similar to your original *if necessary*, but prioritize the specific selector
+    if not ingredient_list_items:
+         log.debug("  -> 'li.ingredient_item' not found. Trying 'section.borderSection > li.ingredient'...")
+         ingredients_section = soup.find('section', class_='borderSection')
+         if ingredients_section:
+             METRICS.inc('food5_extractor_fallback_total', path='ingredients_border_section')
+             ingredient_list_items = ingredients_section.find_all('li', class_='ingredient')
+    # Add other fallbacks from your original working file if needed here
+
+    log.debug("  -> Found %d potential ingredient list items.", len(ingredient_list_items))
+
+    if ingredient_list_items:
+        for i, item in enumerate(ingredient_list_items):
+            # 1. Find the NAME span specifically
+            name_span = item.find('span', class_='ingredient_label')
+            ingredient_name = name_span.get_text(strip=True) if name_span else None
+
+            # 2. Find the QUANTITY span specifically
+            # Use the exact class from your snippet
+            quantity_span = item.find('span', class_='js-ingredient-qte ingredient_qte')
+            quantity_text = quantity_span.get_text(strip=True) if quantity_span else ""
+
+            # 3. Append ONLY if a valid name was found
+            if ingredient_name:
+                details['ingredients'].append({
+                    'quantity': quantity_text if quantity_text else "-", # Use "-" if quantity missing
+                    'name': ingredient_name
+                })
+                ingredients_found = True
+                # print(f"    -> Added: Qty='{quantity_text if quantity_text else '-'}' Name='{ingredient_name}'") # Debug
+            # else:
+                # print(f"    -> Warning: Skipping item {i+1}, couldn't find 'span.ingredient_label'.")
+
+        if ingredients_found:
+             log.debug("  -> Successfully parsed %d ingredients from list items.", len(details['ingredients']))
+    else:
+        log.debug("  -> No ingredient list items found using primary selectors.")
+        # If your original script had a global fallback like selecting labels directly, add it here.
+        # Example:
+        # print(" -> Trying direct selection of .ingredient_label as fallback...")
+        # direct_labels = soup.select('.ingredient_label')
+        # ... (add logic to append these with quantity '-') ...
+
+
+    record_stage('ingredients', time.perf_counter() - stage_start)
+
+    # --- Find Preparation Steps (Using Logic from your provided file) ---
+    log.debug("--- Attempting Step Extraction (Using Original Logic) ---")
+    stage_start = time.perf_counter()
+    steps_found = False
+    # Use the selectors confirmed to work from your original file
+    preparation_list_ul = soup.find('ul', class_='preparation_steps')
+    if preparation_list_ul:
+        step_list_items = preparation_list_ul.find_all('li', class_='preparation_step', recursive=False) # Direct children
+        if step_list_items:
+            log.debug("  -> Found %d preparation step list items (li.preparation_step).", len(step_list_items))
+            for list_item in step_list_items:
+                step_paragraph = list_item.find('p') # Find 'p' inside the 'li'
+                if step_paragraph:
+                    step_text = step_paragraph.get_text(strip=True)
+                    if step_text:
                         details['steps'].append(step_text)
-                        seen_step_texts.add(step_text)
                         steps_found = True
-                        count += 1
-                if count > 0:
-                    print(f"  -> Added {count} steps via fallback.")
-            # else: print(" -> Fallback section#preparation not found.")
+                # else: print(f"  -> Warning: No <p> tag found within this li.preparation_step.")
+        # else: print(f"  -> Warning: Found ul.preparation_steps, but no li.preparation_step items within it.")
+    # else: print(f"  -> Warning: Could not find the main preparation list (ul.preparation_steps).")
+
+    # Fallback for steps ONLY if primary method found nothing (Keep your original fallback)
+    if not steps_found:
+        preparation_section = soup.find('section', id='preparation')
+        if preparation_section:
+            log.debug(" -> Fallback: Trying any <p> tag inside section#preparation for steps.")
+            METRICS.inc('food5_extractor_fallback_total', path='steps_preparation_section')
+            fallback_paragraphs = preparation_section.find_all('p')
+            count = 0
+            seen_step_texts = set(details['steps']) # Avoid duplicates
+            for p_tag in fallback_paragraphs:
+                step_text = p_tag.get_text(strip=True)
+                # Add a check to avoid adding short/irrelevant text or duplicates
+                if step_text and len(step_text) > 15 and step_text not in seen_step_texts:
+                    details['steps'].append(step_text)
+                    seen_step_texts.add(step_text)
+                    steps_found = True
+                    count += 1
+            if count > 0:
+                log.debug("  -> Added %d steps via fallback.", count)
+        # else: print(" -> Fallback section#preparation not found.")
+    record_stage('steps', time.perf_counter() - stage_start)
+
+    return details, details_error(details, recipe_url)
+
+
+def details_error(details, recipe_url=''):
+    """Final error/warning logic shared by every extractor. Returns the error message or None."""
+    error_message = None
+    if not details['ingredients']:
+         log.warning("Final ingredient list is empty for %s.", recipe_url)
+         METRICS.inc('food5_extraction_empty_total', part='ingredients')
+         error_message = error_message or "Could not find ingredients."
+    if not details['steps']:
+         log.warning("Final preparation step list is empty for %s.", recipe_url)
+         METRICS.inc('food5_extraction_empty_total', part='steps')
+         error_message = error_message or "Could not find preparation steps."
+
+    if not details['ingredients'] and not details['steps']:
+        error_message = "Could not find ingredients OR preparation steps."
+        log.error("%s for %s", error_message, recipe_url)
+
+    log.debug("Scraping finished for %s. Found %d ingredients, %d steps.", recipe_url, len(details['ingredients']), len(details['steps']))
+    return error_message
 
 
-        # --- Final Error/Warning Logic (from your file) ---
-        if not details['ingredients']:
-             print(f"Warning: Final ingredient list is empty for {recipe_url}.")
-             error_message = error_message or "Could not find ingredients."
-        if not details['steps']:
-             print(f"Warning: Final preparation step list is empty for {recipe_url}.")
-             error_message = error_message or "Could not find preparation steps."
+# lxml extractor: same selectors and fallbacks as extract_details_soup(), written as
+# precompiled XPath so no BeautifulSoup tree is built. BeautifulSoup semantics kept:
+# `class_='x'` matches one class token, `class_='a b'` the whole (normalized) attribute,
+# and get_text(strip=True) joins stripped strings, skipping comments and script/style text.
+def _has_class(name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
 
-        if not ingredients_found and not steps_found: # Updated condition
-            error_message = "Could not find ingredients OR preparation steps."
-            print(f"ERROR: {error_message} for {recipe_url}")
+_XP_INGREDIENT_ITEMS = etree.XPath(f"//li[{_has_class('ingredient_item')}]")
+_XP_BORDER_SECTION = etree.XPath(f"(//section[{_has_class('borderSection')}])[1]")
+_XP_SECTION_INGREDIENTS = etree.XPath(f".//li[{_has_class('ingredient')}]")
+_XP_INGREDIENT_LABEL = etree.XPath(f"(.//span[{_has_class('ingredient_label')}])[1]")
+_XP_INGREDIENT_QTY = etree.XPath("(.//span[normalize-space(@class) = 'js-ingredient-qte ingredient_qte'])[1]")
+_XP_PREPARATION_LIST = etree.XPath(f"(//ul[{_has_class('preparation_steps')}])[1]")
+_XP_PREPARATION_STEPS = etree.XPath(f"li[{_has_class('preparation_step')}]")
+_XP_FIRST_PARAGRAPH = etree.XPath("(.//p)[1]")
+_XP_PREPARATION_SECTION = etree.XPath("(//section[@id = 'preparation'])[1]")
+_XP_PARAGRAPHS = etree.XPath(".//p")
+_XP_TEXT = etree.XPath(".//text()[not(ancestor::script or ancestor::style or ancestor::template"
+                       " or ancestor::rt or ancestor::rp)]")
+_lxml_parsers = threading.local()  # lxml parsers must not be shared between threads
 
-        print(f"Scraping finished for {recipe_url}. Found {len(details['ingredients'])} ingredients, {len(details['steps'])} steps.")
+def _html_root(html):
+    """Parses HTML bytes with lxml, picking the encoding the way BeautifulSoup(html, 'lxml') does."""
+    detector = EncodingDetector(html, is_html=True)
+    encoding = next(iter(detector.encodings), None)
+    parsers = getattr(_lxml_parsers, 'by_encoding', None)
+    if parsers is None:
+        parsers = _lxml_parsers.by_encoding = {}
+    parser = parsers.get(encoding)
+    if parser is None:
+        parser = parsers[encoding] = etree.HTMLParser(encoding=encoding, recover=True)
+    try:
+        return etree.fromstring(detector.markup, parser)
+    except etree.XMLSyntaxError:
+        return None  # Empty document
+
+
+def _text(element):
+    return ''.join(text.strip() for text in _XP_TEXT(element))
+
+
+def _first(xpath, element):
+    found = xpath(element)
+    return found[0] if found else None
+
+
+def extract_details_lxml(html, recipe_url=''):
+    """lxml extractor: same output as extract_details_soup(), without building a BeautifulSoup tree."""
+    details = {'ingredients': [], 'steps': []}
+    with timed('parse'):
+        root = _html_root(html)
+    if root is None:
+        return details, details_error(details, recipe_url)
+
+    stage_start = time.perf_counter()
+    ingredient_list_items = _XP_INGREDIENT_ITEMS(root)
+    if not ingredient_list_items:
+        ingredients_section = _first(_XP_BORDER_SECTION, root)
+        if ingredients_section is not None:
+            METRICS.inc('food5_extractor_fallback_total', path='ingredients_border_section')
+            ingredient_list_items = _XP_SECTION_INGREDIENTS(ingredients_section)
+    for item in ingredient_list_items:
+        name_span = _first(_XP_INGREDIENT_LABEL, item)
+        ingredient_name = _text(name_span) if name_span is not None else None
+        if ingredient_name:
+            quantity_span = _first(_XP_INGREDIENT_QTY, item)
+            quantity_text = _text(quantity_span) if quantity_span is not None else ""
+            details['ingredients'].append({'quantity': quantity_text if quantity_text else "-", 'name': ingredient_name})
+    record_stage('ingredients', time.perf_counter() - stage_start)
+
+    stage_start = time.perf_counter()
+    preparation_list_ul = _first(_XP_PREPARATION_LIST, root)
+    if preparation_list_ul is not None:
+        for list_item in _XP_PREPARATION_STEPS(preparation_list_ul):
+            step_paragraph = _first(_XP_FIRST_PARAGRAPH, list_item)
+            if step_paragraph is not None:
+                step_text = _text(step_paragraph)
+                if step_text:
+                    details['steps'].append(step_text)
+    if not details['steps']:
+        preparation_section = _first(_XP_PREPARATION_SECTION, root)
+        if preparation_section is not None:
+            METRICS.inc('food5_extractor_fallback_total', path='steps_preparation_section')
+            seen_step_texts = set()
+            for p_tag in _XP_PARAGRAPHS(preparation_section):
+                step_text = _text(p_tag)
+                if step_text and len(step_text) > 15 and step_text not in seen_step_texts:
+                    details['steps'].append(step_text)
+                    seen_step_texts.add(step_text)
+    record_stage('steps', time.perf_counter() - stage_start)
+
+    return details, details_error(details, recipe_url)
+
+
+RECIPE_EXTRACTORS = {
+    'soup': extract_details_soup,
+    'lxml': extract_details_lxml,
+}
+
+def parse_recipe_details(html, recipe_url='', extractor=None):
+    """Extracts ingredients and steps from recipe page HTML with the configured backend. Returns (details, error_message).
+
+    Every ingredient also gets its quantity parsed into `amount` and `unit` (see parse_quantity()).
+    """
+    details, error_message = RECIPE_EXTRACTORS[extractor or RECIPE_EXTRACTOR](html, recipe_url)
+    for ingredient in details['ingredients']:
+        ingredient['amount'], ingredient['unit'] = parse_quantity(ingredient['quantity'])
+    return details, error_message
 
+
+def scrape_recipe_details(recipe_url):
+    """Fetches and scrapes ingredients (name + quantity) and steps from a single recipe URL."""
+    details = {'ingredients': [], 'steps': []}
+    error_message = None
+    log.debug("Attempting to scrape recipe details from: %s", recipe_url)
+    try:
+        html = fetch_recipe_page(recipe_url)
+        details, error_message = parse_recipe_details(html, recipe_url)
     except requests.exceptions.RequestException as e: error_message = f"Network error scraping: {e}"
-    except Exception as e: error_message = f"Unexpected error scraping: {e}"; traceback.print_exc()
-    if error_message and not details['ingredients'] and not details['steps']: print(f"ERROR during scraping: {error_message}")
+    except Exception as e: error_message = f"Unexpected error scraping: {e}"; log.exception(error_message)
+    if error_message and not details['ingredients'] and not details['steps']: log.error("Scraping %s failed: %s", recipe_url, error_message)
 
     return details, error_message
 
 
+# --- Recipe Detail Cache (in-process LRU + SQLite) ---
+class DetailCache:
+    """Two-tier cache for scrape_recipe_details() results.
+
+    Tier 1 is an in-process LRU bounded by entry count and (JSON) byte size, tier 2
+    the `recipe_details` table of the recipe database. Entries younger than `ttl` are
+    served as-is; entries younger than `ttl + stale_ttl` are served immediately while
+    a background scrape revalidates them. When a scrape fails (upstream down, breaker
+    open), an even older stored copy is served rather than nothing. Concurrent misses
+    for one URL share a single scrape.
+    """
+
+    def __init__(self, loader, max_entries, max_bytes, ttl, stale_ttl):
+        self.loader = loader
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries = OrderedDict()  # url -> (details, warning, fetched_at, size)
+        self._bytes = 0
+        self._inflight = {}  # url -> Future of the scrape in progress
+        self._details_version = None  # get_details_version() the memory tier is valid for
+        self._lock = threading.Lock()
+        self._revalidator = ThreadPoolExecutor(max_workers=2, thread_name_prefix='detail-revalidate')
+        self.counters = {'hits': 0, 'disk_hits': 0, 'stale_hits': 0, 'expired_hits': 0, 'misses': 0,
+                         'coalesced': 0, 'evictions': 0, 'revalidations': 0}
+
+    def get(self, url):
+        """Returns (details, error_message) like scrape_recipe_details(), from cache when possible."""
+        cached = self.lookup(url)
+        return cached if cached is not None else self.load(url)
+
+    def lookup(self, url):
+        """Cache-only part of get(): (details, error_message), or None on a miss. Never waits on upstream."""
+        now = time.time()
+        self._sync()
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None:
+                self._entries.move_to_end(url)
+        tier = 'hits'
+        if entry is None:
+            entry = self._read_disk(url)
+            tier = 'disk_hits'
+        if entry is not None:
+            details, warning, fetched_at, _ = entry
+            age = now - fetched_at
+            if age < self.ttl + self.stale_ttl:
+                if tier == 'disk_hits':
+                    self._remember(url, entry)
+                if age >= self.ttl:
+                    tier = 'stale_hits'
+                    self._schedule_revalidation(url)
+                self._count(tier)
+                return details, warning
+        return None
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, entries=len(self._entries), bytes=self._bytes)
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def load(self, url):
+        """Scrapes `url` (a miss), or waits for the scrape another thread already started."""
+        with self._lock:
+            self.counters['misses'] += 1
+            future = self._inflight.get(url)
+            leader = future is None
+            if leader:
+                future = self._inflight[url] = Future()
+            else:
+                self.counters['coalesced'] += 1
+        if not leader:
+            return future.result()
+        return self._scrape(url, future)
+
+    def submit(self, url, executor):
+        """Non-blocking load(): scrapes `url` on `executor` (or joins the scrape in flight) and returns a Future."""
+        with self._lock:
+            self.counters['misses'] += 1
+            future = self._inflight.get(url)
+            if future is not None:
+                self.counters['coalesced'] += 1
+                return future
+            future = self._inflight[url] = Future()
+        executor.submit(copy_context().run, self._scrape, url, future)  # Keeps the request's Server-Timing
+        return future
+
+    def _scrape(self, url, future):
+        try:
+            details, error_message = self.loader(url)
+            if details['ingredients'] or details['steps']:
+                # Only real pages are cached; network errors and empty pages are retried next time
+                self.put(url, details, error_message)
+            else:
+                expired = self._read_disk(url)
+                if expired is not None:  # Upstream failing (or breaker open): an outdated page beats none
+                    self._count('expired_hits')
+                    details, error_message = expired[0], expired[1]
+            future.set_result((details, error_message))
+            return details, error_message
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(url, None)
+
+    def _schedule_revalidation(self, url):
+        with self._lock:
+            if url in self._inflight:
+                return
+            future = self._inflight[url] = Future()
+            self.counters['revalidations'] += 1
+        self._revalidator.submit(self._scrape, url, future)
+
+    def put(self, url, details, warning, fetched_at=None):
+        """Stores a result in both tiers. Returns False when the content is the one already stored.
+
+        The row also records the sitemap <lastmod> it was scraped at, and the indexes are
+        only updated when the content hash changed.
+        """
+        fetched_at = fetched_at or time.time()
+        payload = json.dumps(details, ensure_ascii=False)
+        content_hash = hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+        conn = get_db()
+        previous = conn.execute("SELECT details, content_hash FROM recipe_details WHERE url = ?", (url,)).fetchone()
+        changed = previous is None or previous['content_hash'] != content_hash
+        with conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO recipe_details (url, details, warning, fetched_at, lastmod, content_hash)
+                VALUES (?, ?, ?, ?, (SELECT lastmod FROM recipes WHERE url = ?), ?)
+            """, (url, payload, warning, fetched_at, url, content_hash))
+            version = bump_details_version(conn, [url]) if changed else None
+        self._remember(url, (details, warning, fetched_at, len(payload)))
+        if not changed:
+            return False
+        self._advance(version)
+        index_recipe_details(url, details, json.loads(previous['details']) if previous is not None else None, version)
+        return True
+
+    def expire(self, urls):
+        """Marks cached recipes as stale (their page changed or left the catalog).
+
+        Disk entries are served once more while a revalidation re-scrapes them; memory
+        entries are dropped so the next lookup reads the disk tier (in other processes
+        too, through the details version).
+        """
+        if not urls:
+            return
+        stale_at = time.time() - self.ttl
+        conn = get_db()
+        with conn:
+            conn.executemany("UPDATE recipe_details SET fetched_at = MIN(fetched_at, ?) WHERE url = ?",
+                             [(stale_at, url) for url in urls])
+            version = bump_details_version(conn, urls)
+        with self._lock:
+            for url in urls:
+                entry = self._entries.pop(url, None)
+                if entry is not None:
+                    self._bytes -= entry[3]
+        self._advance(version)
+
+    def _sync(self):
+        """Drops the memory entries of recipes another process changed or expired since the last call.
+
+        The changed URLs come from the details_changes log; only when it no longer goes back
+        far enough is the whole memory tier dropped.
+        """
+        version = get_details_version()
+        with self._lock:
+            seen = self._details_version
+        if seen == version:
+            return
+        changed = get_details_changes(seen, version) if seen is not None and seen < version else None
+        with self._lock:
+            if seen is not None:
+                if changed is None:
+                    self._entries.clear()
+                    self._bytes = 0
+                else:
+                    for url in changed:
+                        entry = self._entries.pop(url, None)
+                        if entry is not None:
+                            self._bytes -= entry[3]
+            if self._details_version == seen:  # Not moved by another thread meanwhile
+                self._details_version = version
+
+    def _advance(self, version):
+        """Records a details version this process produced itself (the memory tier is already up to date).
+
+        If another process bumped the counter in between, the next _sync() still sees the gap.
+        """
+        with self._lock:
+            if self._details_version == version - 1:
+                self._details_version = version
+
+    def _read_disk(self, url):
+        row = get_db().execute("SELECT details, warning, fetched_at FROM recipe_details WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row['details']), row['warning'], row['fetched_at'], len(row['details'])
+
+    def _remember(self, url, entry):
+        with self._lock:
+            previous = self._entries.pop(url, None)
+            if previous is not None:
+                self._bytes -= previous[3]
+            self._entries[url] = entry
+            self._bytes += entry[3]
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted[3]
+                self.counters['evictions'] += 1
+
+
+DETAIL_CACHE = DetailCache(scrape_recipe_details, DETAIL_CACHE_MAX_ENTRIES, DETAIL_CACHE_MAX_BYTES,
+                           DETAIL_CACHE_TTL_SECONDS, DETAIL_CACHE_STALE_SECONDS)
+SCRAPE_EXECUTOR = ThreadPoolExecutor(max_workers=SCRAPE_CONCURRENCY, thread_name_prefix='scrape')
+
+
+# --- Bulk Offline Crawler ---
+CRAWL_BREAKER_WAITS = 3  # Cooldowns a crawled page waits out while the site's breaker is open, then it fails
+class RateLimiter:
+    """Spaces calls to wait() at least 1/rate seconds apart, across threads."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def crawl_recipe(recipe_url, limiter):
+    """Fetches, parses and stores one recipe. Returns (ok, changed, network_seconds, parse_seconds, bytes)."""
+    limiter.wait()
+    start = time.perf_counter()
+    for attempt in range(CRAWL_BREAKER_WAITS + 1):
+        try:
+            html = fetch_recipe_page(recipe_url)
+            break
+        except UpstreamUnavailable as e:
+            if attempt == CRAWL_BREAKER_WAITS:
+                log.error("Giving up on %s: %s", recipe_url, e)
+                return False, False, time.perf_counter() - start, 0.0, 0
+            # The site is failing: wait for the breaker's trial request instead of failing the rest of the list
+            time.sleep(max(e.retry_after, 1.0))
+            start = time.perf_counter()
+        except requests.exceptions.RequestException as e:
+            log.error("Network error crawling %s: %s", recipe_url, e)
+            return False, False, time.perf_counter() - start, 0.0, 0
+    fetched = time.perf_counter()
+    details, error_message = parse_recipe_details(html, recipe_url)
+    parsed = time.perf_counter()
+    ok = changed = False
+    if details['ingredients'] or details['steps']:
+        ok = True
+        changed = DETAIL_CACHE.put(recipe_url, details, error_message)
+    return ok, changed, fetched - start, parsed - fetched, len(html)
+
+
+def crawl_catalog(workers=CRAWL_WORKERS, rate=CRAWL_RATE, limit=None, refresh=False):
+    """Scrapes every catalog recipe into the recipe database, skipping recipes already stored.
+
+    Each result is committed as soon as it is parsed, so an interrupted crawl resumes
+    where it stopped. `refresh` re-scrapes recipes older than DETAIL_CACHE_TTL_SECONDS.
+    """
+    catalog, errors = load_catalog()
+    for error in errors:
+        log.warning(error)
+    conn = get_db()
+    if refresh:
+        done = {row['url'] for row in conn.execute(
+            "SELECT url FROM recipe_details WHERE fetched_at >= ?", (time.time() - DETAIL_CACHE_TTL_SECONDS,))}
+    else:
+        done = {row['url'] for row in conn.execute("SELECT url FROM recipe_details")}
+    todo = [url for url in catalog.urls() if url not in done]
+    if limit is not None:
+        todo = todo[:limit]
+    print(f"--- Crawling {len(todo)} recipes ({len(done)} already stored) with {workers} workers at <= {rate} pages/s ---")
+    return crawl_urls(todo, workers, rate)
+
+
+def crawl_urls(todo, workers, rate):
+    """Runs crawl_recipe() over `todo` with `workers` threads at <= `rate` pages/s and prints a report."""
+    limiter = RateLimiter(rate)
+    totals = {'ok': 0, 'unchanged': 0, 'failed': 0, 'network': 0.0, 'parse': 0.0, 'bytes': 0}
+    start = time.perf_counter()
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='crawl')
+    try:
+        futures = [executor.submit(crawl_recipe, url, limiter) for url in todo]
+        for count, future in enumerate(as_completed(futures), 1):
+            ok, changed, network_time, parse_time, size = future.result()
+            totals['ok' if ok else 'failed'] += 1
+            totals['unchanged'] += ok and not changed
+            totals['network'] += network_time
+            totals['parse'] += parse_time
+            totals['bytes'] += size
+            if count % 100 == 0:
+                print(f"  -> {count}/{len(todo)} pages ({count / (time.perf_counter() - start):.1f} pages/s)")
+    except KeyboardInterrupt:
+        print("Interrupted: progress is saved, run the crawl again to resume.")
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    elapsed = time.perf_counter() - start
+    pages = totals['ok'] + totals['failed']
+    print(f"--- Crawl finished: {totals['ok']} stored ({totals['unchanged']} unchanged), "
+          f"{totals['failed']} failed in {elapsed:.1f}s ---")
+    if pages:
+        print(f"  Throughput:   {pages / elapsed:.2f} pages/s, {totals['bytes'] / elapsed / 1024:.1f} KiB/s")
+        print(f"  Network time: {totals['network'] / pages * 1000:.1f} ms/page (total {totals['network']:.1f}s)")
+        print(f"  Parse time:   {totals['parse'] / pages * 1000:.1f} ms/page (total {totals['parse']:.1f}s)")
+    return totals
+
+
+def sync_catalog(workers=CRAWL_WORKERS, rate=CRAWL_RATE, limit=None):
+    """Incremental sync: refreshes every sitemap, then re-scrapes only what changed.
+
+    The work list is the recipes added by this refresh plus every stored recipe whose
+    sitemap <lastmod> differs from the one it was scraped at. Removed recipes are
+    already dropped by the refresh, and re-scraped pages whose content hash is unchanged
+    leave the indexes alone, so a sync costs in proportion to the change set.
+    """
+    delta = refresh_catalog(force=True)
+    if delta is None:
+        print("Error: a catalog refresh is already running.")
+        return None
+    conn = get_db()
+    changed = [row['url'] for row in conn.execute("""
+        SELECT d.url FROM recipe_details d JOIN recipes r ON r.url = d.url
+        WHERE d.lastmod IS NOT NULL AND r.lastmod IS NOT NULL AND d.lastmod != r.lastmod
+    """)]
+    stored = {row['url'] for row in conn.execute("SELECT url FROM recipe_details")}
+    todo = changed + [url for url in delta['added'] if url not in stored]
+    if limit is not None:
+        todo = todo[:limit]
+    print(f"--- Sync: {len(delta['added'])} added, {len(delta['removed'])} removed, {len(changed)} changed recipes; "
+          f"re-scraping {len(todo)} with {workers} workers at <= {rate} pages/s ---")
+    totals = crawl_urls(todo, workers, rate)
+    totals.update({key: len(urls) for key, urls in delta.items()})
+    return totals
+
+
+# --- Recipe Image Thumbnails ---
+# /img/<id> serves card-sized thumbnails of the sitemap images instead of hot-linking the
+# originals. Each source image is downloaded once and resized, both encodings are kept in
+# IMAGE_CACHE_DIR, and the `thumbnails` table tracks their size and last access (LRU
+# eviction past IMAGE_CACHE_MAX_BYTES) as well as failed sources, which are not
+# downloaded again before IMAGE_FAILURE_TTL_SECONDS (negative cache). Misses are built on
+# THUMBNAIL_EXECUTOR, not on the request thread: a cold page of 48 cards must not take
+# up the threads of a worker while the image host is slow.
+THUMBNAIL_FORMATS = {'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+                     'jpg': ('JPEG', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True})}
+if Image is not None and not pil_features.check('webp'):
+    del THUMBNAIL_FORMATS['webp']  # Pillow built without libwebp
+IMAGE_TOUCH_INTERVAL = 600  # Seconds between two LRU timestamp updates of a cached thumbnail
+_thumbnail_inflight = {}  # recipe id -> Future of the thumbnail being built
+_thumbnail_lock = threading.Lock()
+THUMBNAIL_EXECUTOR = ThreadPoolExecutor(max_workers=THUMBNAIL_CONCURRENCY, thread_name_prefix='thumbnail')
+
+def make_thumbnails(data, size=THUMBNAIL_SIZE):
+    """Resizes source image bytes to `size`, cropped like the cards (object-fit: cover). Returns {ext: bytes}."""
+    with Image.open(io.BytesIO(data)) as image:
+        image.draft('RGB', size)  # JPEG: decode directly at the smallest scale still >= size
+        thumbnail = ImageOps.fit(ImageOps.exif_transpose(image).convert('RGB'), size, Image.LANCZOS)
+    encoded = {}
+    for ext, (image_format, _, options) in THUMBNAIL_FORMATS.items():
+        buffer = io.BytesIO()
+        thumbnail.save(buffer, image_format, **options)
+        encoded[ext] = buffer.getvalue()
+    return encoded
+
+
+def build_thumbnails(source_url, resize=make_thumbnails):
+    """Downloads one source image and resizes it with `resize`. Returns ({ext: bytes} or None, error_message).
+
+    UpstreamUnavailable and DeadlineExceeded are raised instead, as they are no reason to give up on the image.
+    """
+    try:
+        with timed('image_fetch'), deadline(PAGE_DEADLINE_SECONDS):
+            response = http_get(source_url)
+            response.raise_for_status()
+        METRICS.inc('food5_upstream_bytes_total', len(response.content), kind='image')
+        with timed('image_resize'):
+            return resize(response.content), None
+    except (UpstreamUnavailable, DeadlineExceeded):
+        raise  # Says nothing about the image: not worth a negative cache entry
+    except requests.exceptions.RequestException as e:
+        return None, f"Network error fetching image: {e}"
+    except (OSError, Image.DecompressionBombError) as e:  # Not an image / truncated / too large
+        return None, f"Unusable image: {e}"
+
+
+def thumbnail_path(recipe_id, ext):
+    return os.path.join(IMAGE_CACHE_DIR, f'{recipe_id % 256:02x}', f'{recipe_id}.{ext}')
+
+
+def store_thumbnails(conn, recipe_id, source_url, encoded, error_message):
+    """Saves the thumbnails of one recipe (or its failure), then evicts past IMAGE_CACHE_MAX_BYTES."""
+    now = time.time()
+    if encoded is None:
+        log.info("Thumbnail of recipe %s failed: %s", recipe_id, error_message)
+        with conn:
+            conn.execute("""
+                INSERT INTO thumbnails (recipe_id, source_url, bytes, accessed_at, failed_at, error) VALUES (?, ?, 0, NULL, ?, ?)
+                ON CONFLICT(recipe_id) DO UPDATE SET source_url = excluded.source_url, bytes = 0, accessed_at = NULL,
+                    failed_at = excluded.failed_at, error = excluded.error
+            """, (recipe_id, source_url, now, error_message))
+        return
+    for ext, data in encoded.items():
+        path = thumbnail_path(recipe_id, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        with open(temporary, 'wb') as f:
+            f.write(data)
+        os.replace(temporary, path)
+    with conn:
+        conn.execute("""
+            INSERT INTO thumbnails (recipe_id, source_url, bytes, accessed_at, failed_at, error) VALUES (?, ?, ?, ?, NULL, NULL)
+            ON CONFLICT(recipe_id) DO UPDATE SET source_url = excluded.source_url, bytes = excluded.bytes,
+                accessed_at = excluded.accessed_at, failed_at = NULL, error = NULL
+        """, (recipe_id, source_url, sum(map(len, encoded.values())), now))
+    evict_thumbnails(conn)
+
+
+def evict_thumbnails(conn):
+    """Deletes the least recently used thumbnails until the cache is back under 90% of IMAGE_CACHE_MAX_BYTES."""
+    total = conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM thumbnails").fetchone()[0]
+    if total <= IMAGE_CACHE_MAX_BYTES:
+        return
+    evicted = []
+    for row in conn.execute("SELECT recipe_id, bytes FROM thumbnails WHERE bytes > 0 ORDER BY accessed_at").fetchall():
+        if total <= IMAGE_CACHE_MAX_BYTES * 0.9:  # Some headroom, so that eviction does not run on every store
+            break
+        evicted.append(row['recipe_id'])
+        total -= row['bytes']
+    with conn:
+        conn.executemany("DELETE FROM thumbnails WHERE recipe_id = ?", [(recipe_id,) for recipe_id in evicted])
+    for recipe_id in evicted:
+        for ext in THUMBNAIL_FORMATS:
+            try: os.remove(thumbnail_path(recipe_id, ext))
+            except FileNotFoundError: pass
+
+
+def get_thumbnail(recipe_id, timeout=IMAGE_WAIT_SECONDS):
+    """True when the thumbnails of a recipe are in the cache, building them on THUMBNAIL_EXECUTOR on a miss.
+
+    False when the recipe has no image, or its image failed less than IMAGE_FAILURE_TTL_SECONDS ago.
+    A row whose files are gone (cache directory wiped or moved) counts as a miss.
+    Concurrent misses for the same recipe share one download. Raises UpstreamUnavailable /
+    DeadlineExceeded (nothing stored) when the image host is down or too slow, and
+    concurrent.futures.TimeoutError when the thumbnail is not ready after `timeout`
+    seconds (it is still built and cached in the background).
+    """
+    conn = get_db()
+    row = conn.execute("""
+        SELECT r.image_url, t.source_url, t.bytes, t.accessed_at, t.failed_at
+        FROM recipes r LEFT JOIN thumbnails t ON t.recipe_id = r.id WHERE r.id = ?
+    """, (recipe_id,)).fetchone()
+    if row is None or not row['image_url']:
+        return False
+    now = time.time()
+    if row['source_url'] == row['image_url']:  # Cached for the current image of the recipe
+        if row['bytes'] and all(os.path.exists(thumbnail_path(recipe_id, ext)) for ext in THUMBNAIL_FORMATS):
+            METRICS.inc('food5_image_cache_total', result='hit')
+            if now - row['accessed_at'] > IMAGE_TOUCH_INTERVAL:
+                with conn:
+                    conn.execute("UPDATE thumbnails SET accessed_at = ? WHERE recipe_id = ?", (now, recipe_id))
+            return True
+        if row['failed_at'] is not None and now - row['failed_at'] < IMAGE_FAILURE_TTL_SECONDS:
+            METRICS.inc('food5_image_cache_total', result='negative')
+            return False
+    METRICS.inc('food5_image_cache_total', result='miss')
+    with _thumbnail_lock:
+        future = _thumbnail_inflight.get(recipe_id)
+        if future is None:
+            future = _thumbnail_inflight[recipe_id] = Future()
+            # copy_context(): the image stages still report to this request's Server-Timing
+            THUMBNAIL_EXECUTOR.submit(copy_context().run, _build_thumbnail, recipe_id, row['image_url'], future)
+    return future.result(timeout=timeout)
+
+
+def _build_thumbnail(recipe_id, image_url, future):
+    """THUMBNAIL_EXECUTOR task of get_thumbnail(): downloads, resizes and stores one thumbnail."""
+    try:
+        encoded, error_message = build_thumbnails(image_url)
+        store_thumbnails(get_db(), recipe_id, image_url, encoded, error_message)
+        future.set_result(encoded is not None)
+    except BaseException as e:
+        future.set_exception(e)
+    finally:
+        with _thumbnail_lock:
+            _thumbnail_inflight.pop(recipe_id, None)
+
+
+def prewarm_thumbnail(recipe_id, source_url, limiter, pool):
+    """Downloads one image on this thread and resizes it in the process pool. Returns True on success."""
+    limiter.wait()
+    try:
+        encoded, error_message = build_thumbnails(source_url, lambda data: pool.submit(make_thumbnails, data).result())
+    except UpstreamUnavailable as e:
+        time.sleep(max(e.retry_after, 1.0))  # Hold this worker back until the breaker lets a request through again
+        return False
+    except DeadlineExceeded:
+        return False
+    store_thumbnails(get_db(), recipe_id, source_url, encoded, error_message)
+    return encoded is not None
+
+
+def prewarm_thumbnails(workers=CRAWL_WORKERS, processes=None, rate=CRAWL_RATE, limit=None):
+    """Creates the thumbnails of every catalog recipe not cached yet (or whose failure expired).
+
+    Downloads run on `workers` threads at <= `rate` images/second; resizing, which is
+    CPU-bound, runs in a pool of `processes` processes (default: one per CPU).
+    """
+    if Image is None:
+        print("Error: Install Pillow to create thumbnails")
+        return None
+    load_catalog()
+    todo = get_db().execute("""
+        SELECT r.id, r.image_url FROM recipes r LEFT JOIN thumbnails t ON t.recipe_id = r.id
+        WHERE r.image_url IS NOT NULL
+          AND (t.recipe_id IS NULL OR t.source_url != r.image_url OR (t.bytes = 0 AND t.failed_at < ?))
+        ORDER BY r.sitemap_rank, r.position
+    """, (time.time() - IMAGE_FAILURE_TTL_SECONDS,)).fetchall()
+    if limit is not None:
+        todo = todo[:limit]
+    print(f"--- Creating thumbnails for {len(todo)} recipes: {workers} download threads at <= {rate} images/s, "
+          f"{processes or os.cpu_count()} resize processes ---")
+    limiter = RateLimiter(rate)
+    totals = {'ok': 0, 'failed': 0}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=processes) as pool, \
+            ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumbnails') as executor:
+        try:
+            futures = [executor.submit(prewarm_thumbnail, row['id'], row['image_url'], limiter, pool) for row in todo]
+            for count, future in enumerate(as_completed(futures), 1):
+                totals['ok' if future.result() else 'failed'] += 1
+                if count % 100 == 0:
+                    print(f"  -> {count}/{len(todo)} images ({count / (time.perf_counter() - start):.1f} images/s)")
+        except KeyboardInterrupt:
+            print("Interrupted: finished thumbnails are saved, run the command again to resume.")
+            executor.shutdown(wait=True, cancel_futures=True)
+    print(f"--- Thumbnails finished: {totals['ok']} created, {totals['failed']} failed "
+          f"in {time.perf_counter() - start:.1f}s ---")
+    return totals
+
+
+# --- Recipe Search Index ---
+# Inverted index over the recipe titles (derived from the URL slug) and the ingredient
+# names already scraped into the recipe database. Tokens are accent-folded so that
+# "creme" finds "Crème", the last query word also matches as a prefix (search-as-you-type)
+# and words with no exact/prefix match fall back to trigram similarity (typos).
+TITLE_WEIGHT = 1.0
+INGREDIENT_WEIGHT = 0.3
+PREFIX_FACTOR = 0.6
+FUZZY_FACTOR = 0.3
+FUZZY_MIN_SIMILARITY = 0.3
+# Minimum seconds between rebuilds caused by details stored in another process (a crawl stores several per second)
+INDEX_REFRESH_SECONDS = 10.0
+_LIGATURES = str.maketrans({'œ': 'oe', 'Œ': 'oe', 'æ': 'ae', 'Æ': 'ae', 'ß': 'ss'})
+_NON_WORD_RE = re.compile(r'[^a-z0-9]+')
+
+def recipe_title(recipe_url):
+    """Display title derived from a recipe URL slug (same as the home page cards always showed)."""
+    return do_title(recipe_url.split('/')[-1].replace('.aspx', '').replace('-', ' '))
+
+
+def fold_text(text):
+    """Lowercases, removes accents and ligatures: 'Crème brûlée' -> 'creme brulee'."""
+    decomposed = unicodedata.normalize('NFKD', text.translate(_LIGATURES).lower())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    """Splits text into accent-folded alphanumeric tokens."""
+    return [token for token in _NON_WORD_RE.split(fold_text(text)) if token]
+
+
+def trigrams(token):
+    padded = f' {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """Ranked search over a CompactCatalog with per-token posting lists of catalog positions."""
+
+    def __init__(self, catalog, ingredients_by_url=None):
+        ingredients_by_url = ingredients_by_url or {}
+        self.documents = catalog
+        title_postings, ingredient_postings = {}, {}
+        for doc in range(len(catalog)):
+            for token in set(tokenize(catalog.title(doc))):
+                title_postings.setdefault(token, []).append(doc)
+        for url, names in ingredients_by_url.items():
+            doc = catalog.find(url)
+            if doc is not None:
+                for token in {t for name in names for t in tokenize(name)}:
+                    ingredient_postings.setdefault(token, []).append(doc)
+        # Titles are visited in catalog order, so their posting lists are already sorted
+        self.title_postings = {token: array('I', docs) for token, docs in title_postings.items()}
+        self.ingredient_postings = {token: array('I', sorted(docs)) for token, docs in ingredient_postings.items()}
+        self.vocabulary = sorted(self.title_postings.keys() | self.ingredient_postings.keys())
+        self.trigram_tokens = {}
+        for token in self.vocabulary:
+            for trigram in trigrams(token):
+                self.trigram_tokens.setdefault(trigram, []).append(token)
+        self._lock = threading.Lock()
+
+    def set_ingredients(self, url, old_names, new_names):
+        """Moves one recipe from the postings of its old ingredient tokens to the new ones.
+
+        Posting lists and the vocabulary are replaced, never mutated, so concurrent
+        searches see either the old or the new list.
+        """
+        doc = self.documents.find(url)
+        if doc is None:
+            return
+        old_tokens = {t for name in old_names for t in tokenize(name)}
+        new_tokens = {t for name in new_names for t in tokenize(name)}
+        with self._lock:
+            for token in old_tokens - new_tokens:
+                postings = self.ingredient_postings.get(token)
+                if postings is None:
+                    continue
+                remaining = array('I', (d for d in postings if d != doc))
+                if remaining:
+                    self.ingredient_postings[token] = remaining
+                else:
+                    del self.ingredient_postings[token]
+            for token in new_tokens - old_tokens:
+                postings = self.ingredient_postings.get(token, array('I'))
+                i = bisect_left(postings, doc)
+                if i < len(postings) and postings[i] == doc:
+                    continue
+                self.ingredient_postings[token] = postings[:i] + array('I', [doc]) + postings[i:]
+                i = bisect_left(self.vocabulary, token)
+                if i == len(self.vocabulary) or self.vocabulary[i] != token:
+                    self.vocabulary = self.vocabulary[:i] + [token] + self.vocabulary[i:]
+                    for trigram in trigrams(token):
+                        self.trigram_tokens.setdefault(trigram, []).append(token)
+
+    def _expand(self, query_token, prefix):
+        """Returns [(index_token, factor)] matching one query token."""
+        matches = []
+        if query_token in self.title_postings or query_token in self.ingredient_postings:
+            matches.append((query_token, 1.0))
+        if prefix:
+            vocabulary = self.vocabulary  # set_ingredients() may swap in a new list
+            i = bisect_left(vocabulary, query_token)
+            while i < len(vocabulary) and vocabulary[i].startswith(query_token):
+                if vocabulary[i] != query_token:
+                    matches.append((vocabulary[i], PREFIX_FACTOR))
+                i += 1
+        if not matches:
+            query_trigrams = trigrams(query_token)
+            shared = {}
+            for trigram in query_trigrams:
+                for token in self.trigram_tokens.get(trigram, ()):
+                    shared[token] = shared.get(token, 0) + 1
+            for token, count in shared.items():
+                similarity = count / (len(query_trigrams) + len(trigrams(token)) - count)
+                if similarity >= FUZZY_MIN_SIMILARITY:
+                    matches.append((token, FUZZY_FACTOR * similarity))
+        return matches
+
+    def _score_token(self, query_token, prefix):
+        scores = {}
+        for token, factor in self._expand(query_token, prefix):
+            for postings, weight in ((self.title_postings, TITLE_WEIGHT), (self.ingredient_postings, INGREDIENT_WEIGHT)):
+                score = factor * weight
+                for doc in postings.get(token, ()):
+                    if scores.get(doc, 0.0) < score:
+                        scores[doc] = score
+        return scores
+
+    def search(self, query, page=1, limit=SEARCH_PAGE_SIZE):
+        """Returns (total, documents of the requested page). Every query word must match."""
+        query_tokens = tokenize(query or '')
+        start = (page - 1) * limit
+        if not query_tokens:
+            return len(self.documents), self.documents[start:start + limit]
+        totals = None
+        for position, query_token in enumerate(query_tokens):
+            # Only the word being typed (the last one) is completed as a prefix
+            scores = self._score_token(query_token, prefix=position == len(query_tokens) - 1)
+            if totals is None:
+                totals = scores
+            else:
+                totals = {doc: total + scores[doc] for doc, total in totals.items() if doc in scores}
+            if not totals:
+                return 0, []
+        ranked = sorted(totals, key=lambda doc: (-totals[doc], doc))
+        return len(ranked), [self.documents[doc] for doc in ranked[start:start + limit]]
+
+
+_search_index = {'version': None, 'index': None, 'built_at': 0.0}  # version: (catalog version, details version)
+_search_index_lock = threading.Lock()
+
+def get_search_index():
+    """Returns the search index of the current catalog.
+
+    It is rebuilt when the catalog version changed, or when the details version moved
+    because another process (crawler, sync, another worker) stored or expired details.
+    Those rebuilds happen at most every INDEX_REFRESH_SECONDS, on one thread, while the
+    other requests keep searching the current index.
+    """
+    catalog, _ = load_catalog()
+    version = (_catalog_cache['version'], get_details_version())  # Read before the names it covers
+    current = _search_index['version']
+    if current == version:
+        return _search_index['index']
+    if current is not None and current[0] == version[0]:
+        if time.monotonic() - _search_index['built_at'] < INDEX_REFRESH_SECONDS:
+            return _search_index['index']
+        if not _search_index_lock.acquire(blocking=False):  # Another thread is rebuilding
+            return _search_index['index']
+    else:
+        _search_index_lock.acquire()
+    try:
+        if _search_index['version'] != version:
+            ingredients_by_url = load_ingredient_names()
+            _search_index['index'] = SearchIndex(catalog, ingredients_by_url)
+            _ingredient_index['index'] = IngredientIndex(catalog, ingredients_by_url)
+            _search_index['version'] = version
+            _search_index['built_at'] = time.monotonic()
+    finally:
+        _search_index_lock.release()
+    return _search_index['index']
+
+
+def load_ingredient_names():
+    """Returns {recipe_url: [ingredient names]} for every recipe in the recipe database."""
+    return {row['url']: [i['name'] for i in json.loads(row['details'])['ingredients']]
+            for row in get_db().execute("SELECT url, details FROM recipe_details")}
+
+
+# --- Ingredient Index ("what can I cook with...") ---
+# Each normalized ingredient name maps to a bitmap of recipes (a Python int, bit n set
+# when document n of the search index uses it), so AND/OR/NOT queries are single
+# big-integer operations over the whole catalog. Details stored by this process update
+# the bitmaps in place; details stored by another process (crawler, other workers) move
+# the shared details version, and the next query rebuilds the index from the database.
+_INGREDIENT_STOPWORDS = {'de', 'du', 'des', 'd', 'la', 'le', 'les', 'l', 'a', 'au', 'aux', 'en', 'et', 'ou',
+                         'pour', 'un', 'une', 'sur', 'avec'}
+# Always assumed to be available in a pantry query
+PANTRY_STAPLES = ('eau', 'sel', 'poivre')
+
+def ingredient_tokens(name):
+    """Significant folded, singularized words of an ingredient name: "Gousses d'ail (frais)" -> ['gousse', 'ail']."""
+    tokens = []
+    for token in tokenize(re.sub(r'\([^)]*\)', ' ', name)):
+        if token in _INGREDIENT_STOPWORDS or token.isdigit():
+            continue
+        if len(token) > 3 and token[-1] in 'sx':
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+@lru_cache(maxsize=65536)
+def normalize_ingredient(name):
+    return ' '.join(ingredient_tokens(name))
+
+
+def bitmap_from_positions(positions, size):
+    """Builds the int bitmap with the given bit positions set."""
+    buffer = bytearray((size + 7) // 8)
+    for position in positions:
+        buffer[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+def iter_bits(bitmap):
+    """Yields the positions of the set bits of `bitmap`, lowest first."""
+    binary = bin(bitmap)[:1:-1]
+    position = binary.find('1')
+    while position != -1:
+        yield position
+        position = binary.find('1', position + 1)
+
+
+class IngredientIndex:
+    """Normalized ingredient name -> bitmap of the recipes using it."""
+
+    def __init__(self, documents, ingredients_by_url):
+        self.documents = documents  # CompactCatalog
+        self.name_bitmaps = {}  # normalized name -> bitmap
+        self.token_names = {}  # ingredient token -> normalized names containing it
+        self.doc_names = {}  # doc -> normalized names, to update a recipe in place
+        self._lock = threading.RLock()
+        docs_by_name = {}
+        for url, names in ingredients_by_url.items():
+            doc = documents.find(url)
+            if doc is not None:
+                self.doc_names[doc] = {normalize_ingredient(name) for name in names} - {''}
+                for name in self.doc_names[doc]:
+                    docs_by_name.setdefault(name, []).append(doc)
+        # Bulk build: each bitmap is assembled once instead of growing bit by bit
+        for name, docs in docs_by_name.items():
+            self.name_bitmaps[name] = bitmap_from_positions(docs, len(documents))
+            for token in name.split():
+                self.token_names.setdefault(token, set()).add(name)
+        self.indexed = bitmap_from_positions([doc for doc, names in self.doc_names.items() if names], len(documents))
+
+    def set_recipe(self, url, names):
+        """Adds or replaces the ingredients of one recipe."""
+        doc = self.documents.find(url)
+        if doc is None:
+            return
+        bit = 1 << doc
+        normalized = {normalize_ingredient(name) for name in names} - {''}
+        with self._lock:
+            for name in self.doc_names.pop(doc, ()):
+                self.name_bitmaps[name] &= ~bit
+            for name in normalized:
+                if name not in self.name_bitmaps:
+                    self.name_bitmaps[name] = 0
+                    for token in name.split():
+                        self.token_names.setdefault(token, set()).add(name)
+                self.name_bitmaps[name] |= bit
+            self.doc_names[doc] = normalized
+            self.indexed = (self.indexed | bit) if normalized else (self.indexed & ~bit)
+
+    def term_names(self, term):
+        """Normalized names containing every word of `term` ("poulet" -> "blanc poulet", "poulet fermier", ...)."""
+        tokens = ingredient_tokens(term)
+        if not tokens:
+            return None
+        names = self.token_names.get(tokens[0], set())
+        for token in tokens[1:]:
+            names = names & self.token_names.get(token, set())
+        return names
+
+    def term_bitmap(self, term):
+        names = self.term_names(term)
+        if names is None:
+            return None
+        bitmap = 0
+        for name in names:
+            bitmap |= self.name_bitmaps[name]
+        return bitmap
+
+    def query(self, all_of=(), any_of=(), none_of=(), pantry=None):
+        """Bitmap of the recipes using every `all_of`, at least one `any_of` and no `none_of` ingredient.
+
+        With `pantry`, only recipes whose ingredients are all covered by the pantry
+        (plus PANTRY_STAPLES) are kept. Terms without a significant word are ignored.
+        """
+        result = self.indexed
+        for term in all_of:
+            bitmap = self.term_bitmap(term)
+            if bitmap is not None:
+                result &= bitmap
+        any_bitmaps = [b for b in map(self.term_bitmap, any_of) if b is not None]
+        if any_bitmaps:
+            union = 0
+            for bitmap in any_bitmaps:
+                union |= bitmap
+            result &= union
+        for term in none_of:
+            bitmap = self.term_bitmap(term)
+            if bitmap is not None:
+                result &= ~bitmap
+        if pantry is not None:
+            covered = set()
+            for term in list(pantry) + list(PANTRY_STAPLES):
+                covered |= self.term_names(term) or set()
+            outside = 0
+            for name, bitmap in self.name_bitmaps.items():
+                if name not in covered:
+                    outside |= bitmap
+            result &= ~outside
+        return result
+
+    def search(self, page=1, limit=SEARCH_PAGE_SIZE, **query):
+        """Returns (total, documents of the requested page) in catalog order."""
+        with self._lock:
+            bitmap = self.query(**query)
+        start = (page - 1) * limit
+        results = []
+        for position, doc in enumerate(iter_bits(bitmap)):
+            if position >= start + limit:
+                break
+            if position >= start:
+                results.append(self.documents[doc])
+        return bin(bitmap).count('1'), results
+
+
+_ingredient_index = {'index': None}
+
+def get_ingredient_index():
+    """Returns the ingredient index, built together with the search index of the current catalog."""
+    get_search_index()
+    return _ingredient_index['index']
+
+
+def index_recipe_details(recipe_url, details, previous_details=None, details_version=None):
+    """Updates the in-memory indexes of this process after new details were stored for a recipe.
+
+    `details_version` is the version the store bumped to: when the indexes were current
+    just before it, they are marked current again instead of being rebuilt.
+    """
+    names = [i['name'] for i in details['ingredients']]
+    ingredient_index = _ingredient_index['index']
+    if ingredient_index is not None:
+        ingredient_index.set_recipe(recipe_url, names)
+    search_index = _search_index['index']
+    if search_index is not None:
+        previous_names = [i['name'] for i in previous_details['ingredients']] if previous_details else ()
+        search_index.set_ingredients(recipe_url, previous_names, names)
+    # Not under _search_index_lock (held for whole rebuilds): at worst a racing rebuild is redone
+    catalog_version, indexed_version = _search_index['version'] or (None, None)
+    if details_version is not None and indexed_version == details_version - 1:
+        _search_index['version'] = (catalog_version, details_version)
+
+
+# --- Ingredient Quantities ---
+# Quantity strings ('200 g', '1/2', '1 ½ c. à soupe', '2 à 3 gousses', '-') are parsed
+# once, when a page is scraped, into a number and a canonical unit stored next to the
+# original text. Units of one dimension convert into each other (20 cl of cream and
+# 1/2 l add up to 70 cl); units without a dimension (pinch, clove...) only add up with
+# themselves, and unknown units are kept as written.
+_UNIT_TABLE = {
+    # canonical unit: (dimension, factor to the dimension's base unit, plural, aliases as tokenize() spells them)
+    'mg': ('mass', 0.001, 'mg', ('mg', 'milligramme', 'milligrammes')),
+    'g': ('mass', 1, 'g', ('g', 'gr', 'grs', 'gramme', 'grammes')),
+    'kg': ('mass', 1000, 'kg', ('kg', 'kilo', 'kilos', 'kilogramme', 'kilogrammes')),
+    'ml': ('volume', 1, 'ml', ('ml', 'millilitre', 'millilitres')),
+    'cl': ('volume', 10, 'cl', ('cl', 'centilitre', 'centilitres')),
+    'dl': ('volume', 100, 'dl', ('dl', 'decilitre', 'decilitres')),
+    'l': ('volume', 1000, 'l', ('l', 'litre', 'litres')),
+    'c. à café': ('volume', 5, 'c. à café', ('c a cafe', 'c a c', 'cac', 'cc', 'cuil a cafe', 'cuil a c',
+                                             'cuillere a cafe', 'cuilleres a cafe', 'cuillerees a cafe', 'cuilleree a cafe')),
+    'c. à soupe': ('volume', 15, 'c. à soupe', ('c a soupe', 'c a s', 'cas', 'cs', 'cuil a soupe', 'cuil a s',
+                                                'cuillere a soupe', 'cuilleres a soupe', 'cuillerees a soupe', 'cuilleree a soupe')),
+}
+for _unit in ('pincée', 'gousse', 'tranche', 'sachet', 'boîte', 'botte', 'brin', 'feuille', 'verre', 'tasse',
+              'bouquet', 'filet', 'noix', 'poignée', 'zeste', 'pot', 'branche', 'morceau', 'bâton', 'cube', 'dose'):
+    _plural = _unit if _unit[-1] in 'sxz' else 'morceaux' if _unit == 'morceau' else _unit + 's'
+    _UNIT_TABLE[_unit] = (_unit, 1, _plural, (fold_text(_unit), fold_text(_plural)))
+_UNIT_ALIASES = {alias: unit for unit, (_, _, _, aliases) in _UNIT_TABLE.items() for alias in aliases}
+_METRIC_UNITS = {'mass': ('kg', 'g', 'mg'), 'volume': ('l', 'cl', 'ml')}  # Largest first
+_DECIMAL_UNITS = {'mg', 'g', 'kg', 'ml', 'cl', 'dl', 'l'}  # Shown as decimals, other units as fractions
+_VULGAR_FRACTIONS = {'½': 1 / 2, '¼': 1 / 4, '¾': 3 / 4, '⅓': 1 / 3, '⅔': 2 / 3, '⅛': 1 / 8}
+_FRACTION_GLYPHS = ((1 / 4, '¼'), (1 / 3, '⅓'), (1 / 2, '½'), (2 / 3, '⅔'), (3 / 4, '¾'))
+_NUMBER = r'\d+(?:[.,]\d+)?(?:\s*/\s*\d+)?|[½¼¾⅓⅔⅛]'
+_QUANTITY_RE = re.compile(rf"""
+    ^\s*(?P<whole>\d+\s+(?=\d+\s*/)|\d+\s*(?=[½¼¾⅓⅔⅛]))?    # '1 1/2', '1½'
+    (?P<value>{_NUMBER})
+    (?:\s*(?:-|à)\s*(?P<upper>{_NUMBER}))?                    # '2-3', '2 à 3'
+    \s*(?P<unit>.*?)\s*$""", re.VERBOSE)
+_UNIT_FILLER = {'de', 'd', 'environ'}
+
+def _number(text):
+    if text in _VULGAR_FRACTIONS:
+        return _VULGAR_FRACTIONS[text]
+    if '/' in text:
+        numerator, denominator = text.split('/')
+        return int(numerator) / int(denominator)
+    return float(text.replace(',', '.'))
+
+
+@lru_cache(maxsize=16384)
+def parse_quantity(text):
+    """Parses a quantity string into (amount, unit): '200 g' -> (200.0, 'g'), '1/2' -> (0.5, None).
+
+    Ranges count as their upper bound, units are canonical when known ('c. à s.' ->
+    'c. à soupe') and kept as written otherwise. (None, None) when there is no number.
+    """
+    match = _QUANTITY_RE.match(text or '')
+    if match is None:
+        return None, None
+    try:
+        amount = _number(match['upper'] or match['value'])
+        if match['whole'] and not match['upper']:
+            amount += int(match['whole'])
+    except (ValueError, ZeroDivisionError):
+        return None, None
+    unit_words = [token for token in tokenize(match['unit']) if token not in _UNIT_FILLER]
+    if not unit_words:
+        return amount, None
+    return amount, _UNIT_ALIASES.get(' '.join(unit_words), match['unit'])
+
+
+def ingredient_amount(ingredient):
+    """(amount, unit) of a stored ingredient; details cached before quantities were parsed are parsed now."""
+    if 'amount' in ingredient:
+        return ingredient['amount'], ingredient['unit']
+    return parse_quantity(ingredient['quantity'])
+
+
+def readable_metric(amount, unit):
+    """Re-expresses a metric amount out of the 1-999 range in a better unit of its dimension: 1500 g -> (1.5, 'kg')."""
+    if 1 <= amount < 1000:
+        return amount, unit
+    dimension, factor = _UNIT_TABLE[unit][:2]
+    base = amount * factor
+    for candidate in _METRIC_UNITS[dimension]:
+        if base >= _UNIT_TABLE[candidate][1] or candidate == _METRIC_UNITS[dimension][-1]:
+            return base / _UNIT_TABLE[candidate][1], candidate
+
+
+def format_quantity(amount, unit):
+    """French display of an amount: (1.5, 'kg') -> '1,5 kg', (2.5, 'gousse') -> '2 ½ gousses', (200.0, None) -> '200'."""
+    metric = unit in _DECIMAL_UNITS
+    if metric:
+        amount, unit = readable_metric(amount, unit)
+    number = None
+    if not metric:
+        # Counted things read best as fractions: '½', '1 ¼'
+        whole, rest = divmod(amount, 1)
+        if rest < 0.04 or rest > 0.96:
+            number = str(round(amount))
+        else:
+            for fraction, glyph in _FRACTION_GLYPHS:
+                if abs(rest - fraction) < 0.04:
+                    number = f"{int(whole)} {glyph}" if whole else glyph
+    if number is None:
+        number = f"{amount:.0f}" if amount >= 10 else f"{amount:.2f}".rstrip('0').rstrip('.').replace('.', ',')
+    if unit is None:
+        return number
+    if unit in _UNIT_TABLE and amount > 1:
+        unit = _UNIT_TABLE[unit][2]
+    return f"{number} {unit}"
+
+
+def scale_details(details, servings):
+    """Copy of `details` with every parsed quantity rescaled from RECIPE_SERVINGS to `servings` people."""
+    factor = servings / RECIPE_SERVINGS
+    ingredients = []
+    for ingredient in details['ingredients']:
+        amount, unit = ingredient_amount(ingredient)
+        if amount is not None:
+            amount *= factor
+            if unit in _DECIMAL_UNITS:
+                amount, unit = readable_metric(amount, unit)
+            ingredient = dict(ingredient, amount=amount, unit=unit, quantity=format_quantity(amount, unit))
+        ingredients.append(ingredient)
+    return dict(details, ingredients=ingredients, servings=servings)
+
+
+def build_shopping_list(recipes):
+    """Adds up the ingredients of several recipes; `recipes` is a list of (details, servings).
+
+    Ingredients are grouped by normalized name and dimension, and each parsed amount is
+    added to its group's total in base units (g, ml, or the unit itself). A group whose
+    amounts all used the same unit is shown in that unit. Ingredients without a
+    number ('sel', '-') are listed once with no amount. Returns items sorted by name:
+    {'name', 'amount', 'unit', 'quantity', 'recipes'}.
+    """
+    groups = {}  # (normalized name, dimension) -> group number
+    names, units, recipe_counts, totals = [], [], [], []
+    for details, servings in recipes:
+        factor = servings / RECIPE_SERVINGS
+        counted = set()
+        for ingredient in details['ingredients']:
+            amount, unit = ingredient_amount(ingredient)
+            dimension, unit_factor = _UNIT_TABLE[unit][:2] if unit in _UNIT_TABLE else (unit or 'piece', 1)
+            key = (normalize_ingredient(ingredient['name']) or fold_text(ingredient['name']),
+                   dimension if amount is not None else None)
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = len(names)
+                names.append(ingredient['name'])
+                units.append(unit)
+                recipe_counts.append(0)
+                totals.append(0.0)
+            elif units[group] != unit:
+                units[group] = _METRIC_UNITS[dimension][-1] if dimension in _METRIC_UNITS else unit
+            if group not in counted:
+                counted.add(group)
+                recipe_counts[group] += 1
+            if amount is not None:
+                totals[group] += amount * unit_factor * factor
+    items = []
+    for (name_key, dimension), group in groups.items():
+        unit = units[group] if dimension is not None else None
+        amount = totals[group] / _UNIT_TABLE[unit][1] if unit in _UNIT_TABLE else totals[group]
+        if unit in _DECIMAL_UNITS:
+            amount, unit = readable_metric(amount, unit)
+        items.append({'name': names[group], 'amount': amount if dimension is not None else None, 'unit': unit,
+                      'quantity': format_quantity(amount, unit) if dimension is not None else None,
+                      'recipes': recipe_counts[group], '_key': name_key})
+    items.sort(key=lambda item: (item['_key'], item['unit'] or ''))
+    for item in items:
+        del item['_key']
+    return items
+
+
 # --- HTML Template (Ensuring Correct Display & JS Logic) ---
 HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -213,6 +2505,9 @@ HTML_TEMPLATE = """
         .error strong { color: #ff6b6b; display: block; margin-bottom: 10px; }
         .error ul { margin: 0; padding-left: 20px; }
         .error li { margin-bottom: 5px; }
+        .load-more { text-align: center; margin-top: 25px; }
+        .load-more button { padding: 10px 20px; border-radius: 20px; border: 1px solid #555; background-color: #333; color: #e0e0e0; font-size: 1em; cursor: pointer; }
+        .load-more button:hover { border-color: #64b5f6; }
         .no-recipes, #noResults { text-align: center; font-style: italic; color: #aaa; margin-top: 30px; padding: 20px; }
         #noResults { display: none; }
         /* --- Modal Styles --- */
@@ -257,31 +2552,26 @@ HTML_TEMPLATE = """
         </form>
     </div>
 
-    <!-- Recipe List -->
+    <!-- Recipe List (first page rendered here, the rest comes from /api/search) -->
     {% if recipes %}
         <ul class="recipe-list" id="recipeList">
             {% for recipe in recipes %}
                 <li class="recipe-item" data-url="{{ recipe.url }}">
                     <div class="recipe-image-container">
                     {% if recipe.image_url %}
-                        <img src="{{ recipe.image_url }}" alt="Image for {{ recipe.url.split('/')[-1].replace('.aspx', '') | title }}" onerror="this.style.display='none'; this.nextElementSibling.style.display='flex';" loading="lazy">
+                        <img src="/img/{{ recipe.id }}" alt="Image for {{ recipe.title }}" onerror="this.style.display='none'; this.nextElementSibling.style.display='flex';" loading="lazy">
                         <div class="image-unavailable" style="display:none;">(Image unavailable)</div>
                     {% else %}
                          <div class="no-image">(No image provided)</div>
                     {% endif %}
                     </div>
-                    {% if recipe.url %}
-                    <span class="recipe-title-link">
-                        {{ recipe.url.split('/')[-1].replace('.aspx', '').replace('-', ' ') | title }}
-                    </span>
-                    {% else %}
-                     <span class="recipe-title-link">(Invalid recipe data)</span>
-                    {% endif %}
+                    <span class="recipe-title-link">{{ recipe.title }}</span>
                 </li>
             {% endfor %}
         </ul>
         <p id="noResults">No matching recipes found.</p>
-        <p style="text-align:center; color: #777; margin-top: 20px; font-size: 0.8em;">Displaying {{ recipes | length }} total recipes.</p>
+        <div id="loadMore" class="load-more"{% if recipes | length >= total %} style="display: none;"{% endif %}><button type="button" id="loadMoreBtn">Load more recipes</button></div>
+        <p style="text-align:center; color: #777; margin-top: 20px; font-size: 0.8em;" id="resultCount">Displaying {{ recipes | length }} of {{ total }} total recipes.</p>
     {% elif not errors %}
         <p class="no-recipes">No recipes found in the specified sitemaps.</p>
     {% endif %}
@@ -306,26 +2596,94 @@ HTML_TEMPLATE = """
 
     <!-- JavaScript (Ingredient Display Updated) -->
     <script>
-        // --- Search Filter Function ---
+        // --- Server-side Search & Pagination (/api/search) ---
+        const PAGE_SIZE = {{ page_size }};
+        let currentQuery = '';
+        let currentPage = 1;
+        let totalResults = {{ total }};
+        let searchTimer = null;
+        let requestSeq = 0;
+        let loadingPage = false;
+
+        function createRecipeItem(recipe) {
+            const li = document.createElement('li');
+            li.className = 'recipe-item';
+            li.dataset.url = recipe.url;
+            const imageContainer = document.createElement('div');
+            imageContainer.className = 'recipe-image-container';
+            if (recipe.image_url) {
+                const img = document.createElement('img');
+                img.src = `/img/${recipe.id}`;
+                img.alt = `Image for ${recipe.title}`;
+                img.loading = 'lazy';
+                img.onerror = function() { this.style.display = 'none'; this.nextElementSibling.style.display = 'flex'; };
+                const unavailable = document.createElement('div');
+                unavailable.className = 'image-unavailable';
+                unavailable.style.display = 'none';
+                unavailable.textContent = '(Image unavailable)';
+                imageContainer.appendChild(img);
+                imageContainer.appendChild(unavailable);
+            } else {
+                const noImage = document.createElement('div');
+                noImage.className = 'no-image';
+                noImage.textContent = '(No image provided)';
+                imageContainer.appendChild(noImage);
+            }
+            const title = document.createElement('span');
+            title.className = 'recipe-title-link';
+            title.textContent = recipe.title;
+            li.appendChild(imageContainer);
+            li.appendChild(title);
+            if (prefetchObserver) { prefetchObserver.observe(li); }
+            return li;
+        }
+
+        function updateListFooter() {
+            const recipeList = document.getElementById('recipeList');
+            const shown = recipeList ? recipeList.children.length : 0;
+            const loadMore = document.getElementById('loadMore');
+            const resultCount = document.getElementById('resultCount');
+            const noResultsMsg = document.getElementById('noResults');
+            if (loadMore) { loadMore.style.display = shown < totalResults ? 'block' : 'none'; }
+            if (resultCount) { resultCount.textContent = `Displaying ${shown} of ${totalResults} ${currentQuery ? 'matching' : 'total'} recipes.`; }
+            if (noResultsMsg) { noResultsMsg.style.display = (totalResults === 0 && currentQuery !== '') ? 'block' : 'none'; }
+        }
+
+        function loadPage(query, page, append) {
+            const recipeList = document.getElementById('recipeList');
+            if (!recipeList) return;
+            const seq = ++requestSeq;
+            loadingPage = true;
+            fetch(`/api/search?q=${encodeURIComponent(query)}&page=${page}&limit=${PAGE_SIZE}`)
+                .then(response => { if (!response.ok) { throw new Error(`HTTP ${response.status}: ${response.statusText}`); } return response.json(); })
+                .then(data => {
+                    if (seq !== requestSeq) return; // A newer search superseded this one
+                    if (!append) { recipeList.innerHTML = ''; }
+                    const fragment = document.createDocumentFragment();
+                    data.results.forEach(recipe => fragment.appendChild(createRecipeItem(recipe)));
+                    recipeList.appendChild(fragment);
+                    currentQuery = query;
+                    currentPage = page;
+                    totalResults = data.total;
+                    updateListFooter();
+                })
+                .catch(error => console.error('Search Error:', error))
+                .finally(() => { if (seq === requestSeq) { loadingPage = false; } });
+        }
+
+        // --- Search Filter Function (debounced, queries the server) ---
         function filterRecipes() {
             const searchInput = document.getElementById('searchInput');
             if (!searchInput) return;
-            const filter = searchInput.value.toLowerCase();
+            clearTimeout(searchTimer);
+            searchTimer = setTimeout(() => loadPage(searchInput.value.trim(), 1, false), 200);
+        }
+
+        function loadMoreRecipes() {
             const recipeList = document.getElementById('recipeList');
-            if (!recipeList) return;
-            const items = recipeList.getElementsByClassName('recipe-item');
-            const noResultsMsg = document.getElementById('noResults');
-            let visibleCount = 0;
-            for (let i = 0; i < items.length; i++) {
-                const titleElement = items[i].querySelector('.recipe-title-link');
-                const txtValue = titleElement ? (titleElement.textContent || titleElement.innerText) : '';
-                if (txtValue.toLowerCase().includes(filter)) {
-                    items[i].style.display = "flex"; visibleCount++;
-                } else { items[i].style.display = "none"; }
-            }
-            noResultsMsg.style.display = (visibleCount === 0 && filter !== '') ? 'block' : 'none';
+            if (loadingPage || !recipeList || recipeList.children.length >= totalResults) return;
+            loadPage(currentQuery, currentPage + 1, true);
         }
-        // Initial call moved to DOMContentLoaded
 
         // --- Modal Handling Variables ---
         const modalOverlay = document.getElementById('recipeModalOverlay');
@@ -338,6 +2696,82 @@ HTML_TEMPLATE = """
         const modalIngredientsList = document.getElementById('modalIngredientsList');
         const modalStepsList = document.getElementById('modalStepsList');
 
+        // --- Recipe Details (polls while the server is still scraping the page) ---
+        function fetchRecipeDetails(recipeUrl, attempt = 0) {
+            return fetch(`/get_recipe_details?url=${encodeURIComponent(recipeUrl)}`)
+                .then(response => { if (!response.ok) { throw new Error(`HTTP ${response.status}: ${response.statusText}`); } return response.json(); })
+                .then(data => (data.pending && attempt < 10)
+                    ? new Promise(resolve => setTimeout(resolve, 1000)).then(() => fetchRecipeDetails(recipeUrl, attempt + 1))
+                    : data)
+                .then(data => { if (data.success) { detailCache.set(recipeUrl, Promise.resolve(data)); } return data; });
+        }
+
+        // --- Speculative prefetch of visible and hovered recipes (/api/recipes/details) ---
+        // Only successful answers are kept; a pending or failed one falls back to fetchRecipeDetails() on click
+        const PREFETCH_BATCH = Math.min(12, {{ detail_batch_max }});
+        const detailCache = new Map(); // url -> Promise of the details response, or of null
+        const prefetchQueue = new Set();
+        let prefetchTimer = null;
+
+        function getRecipeDetails(recipeUrl) {
+            return (detailCache.get(recipeUrl) || Promise.resolve(null)).then(data => data || fetchRecipeDetails(recipeUrl));
+        }
+
+        function queuePrefetch(recipeUrl, urgent) {
+            if (!recipeUrl || detailCache.has(recipeUrl)) return;
+            prefetchQueue.add(recipeUrl);
+            if (urgent) { clearTimeout(prefetchTimer); prefetchTimer = null; }
+            if (prefetchTimer === null) { prefetchTimer = setTimeout(flushPrefetch, urgent ? 50 : 300); }
+        }
+
+        function flushPrefetch() {
+            prefetchTimer = null;
+            const urls = [...prefetchQueue].slice(0, PREFETCH_BATCH);
+            urls.forEach(url => prefetchQueue.delete(url));
+            if (prefetchQueue.size) { prefetchTimer = setTimeout(flushPrefetch, 300); }
+            if (!urls.length) return;
+            const waiting = new Map();
+            urls.forEach(url => detailCache.set(url, new Promise(resolve => waiting.set(url, resolve))));
+            const settle = (url, data) => {
+                const resolve = waiting.get(url);
+                if (!resolve) return;
+                waiting.delete(url);
+                if (!data) { detailCache.delete(url); }
+                resolve(data);
+            };
+            readDetailStream(urls, data => settle(data.url, data.success ? data : null))
+                .catch(error => console.warn('Prefetch Error:', error))
+                .finally(() => [...waiting.keys()].forEach(url => settle(url, null)));
+        }
+
+        function readDetailStream(urls, onResult) {
+            // One NDJSON line per recipe, in the order the server has them ready
+            return fetch('/api/recipes/details', { method: 'POST', body: JSON.stringify({ urls }),
+                                                   headers: { 'Content-Type': 'application/json', 'Accept': 'application/x-ndjson' } })
+                .then(response => {
+                    if (!response.ok) { throw new Error(`HTTP ${response.status}: ${response.statusText}`); }
+                    const reader = response.body.getReader();
+                    const decoder = new TextDecoder();
+                    let buffered = '';
+                    const pump = () => reader.read().then(({ done, value }) => {
+                        buffered += decoder.decode(value || new Uint8Array(), { stream: !done });
+                        const lines = buffered.split('\\n');
+                        buffered = lines.pop();
+                        lines.filter(line => line.trim()).forEach(line => onResult(JSON.parse(line)));
+                        return done ? undefined : pump();
+                    });
+                    return pump();
+                });
+        }
+
+        // Cards are prefetched once they stay on screen for a moment (leaving the screen unqueues them)
+        const prefetchObserver = ('IntersectionObserver' in window)
+            ? new IntersectionObserver(entries => entries.forEach(entry => {
+                  if (entry.isIntersecting) { queuePrefetch(entry.target.dataset.url, false); }
+                  else { prefetchQueue.delete(entry.target.dataset.url); }
+              }))
+            : null;
+
         // --- Modal Functions (show/hide) ---
         function showModal() { document.body.classList.add('modal-open'); modalOverlay.classList.add('active'); }
         function hideModal() { document.body.classList.remove('modal-open'); modalOverlay.classList.remove('active'); setTimeout(() => { modalLoadingIndicator.style.display = 'block'; modalErrorMsg.style.display = 'none'; modalRecipeData.style.display = 'none'; modalIngredientsList.innerHTML = ''; modalStepsList.innerHTML = ''; modalRecipeTitle.innerHTML = 'Recipe Details'; }, 300); }
@@ -347,10 +2781,25 @@ HTML_TEMPLATE = """
             const recipeListElement = document.getElementById('recipeList');
             const searchInput = document.getElementById('searchInput');
 
-            if (searchInput) { filterRecipes(); } // Initial filter call
-            else { console.error("Search input 'searchInput' not found."); }
+            if (!searchInput) { console.error("Search input 'searchInput' not found."); }
+            else if (searchInput.value.trim()) { filterRecipes(); } // Browser restored a previous query
+
+            // Fetch the next page when the end of the list scrolls into view (button as fallback)
+            const loadMoreBtn = document.getElementById('loadMoreBtn');
+            if (loadMoreBtn) {
+                loadMoreBtn.addEventListener('click', loadMoreRecipes);
+                if ('IntersectionObserver' in window) {
+                    new IntersectionObserver(entries => { if (entries.some(e => e.isIntersecting)) { loadMoreRecipes(); } },
+                                             { rootMargin: '600px' }).observe(document.getElementById('loadMore'));
+                }
+            }
 
             if (recipeListElement) {
+                if (prefetchObserver) { recipeListElement.querySelectorAll('.recipe-item').forEach(item => prefetchObserver.observe(item)); }
+                const prefetchItem = (event) => { const item = event.target.closest('.recipe-item'); if (item) { queuePrefetch(item.dataset.url, true); } };
+                recipeListElement.addEventListener('mouseover', prefetchItem);
+                recipeListElement.addEventListener('touchstart', prefetchItem, { passive: true });
+
                 console.log("Recipe list found, attaching click listener.");
                 recipeListElement.addEventListener('click', (event) => {
                     const clickedItem = event.target.closest('.recipe-item');
@@ -364,8 +2813,7 @@ HTML_TEMPLATE = """
                             modalLoadingIndicator.style.display = 'block'; modalErrorMsg.style.display = 'none'; modalRecipeData.style.display = 'none';
                             showModal();
 
-                            fetch(`/get_recipe_details?url=${encodeURIComponent(recipeUrl)}`)
-                                .then(response => { if (!response.ok) { throw new Error(`HTTP ${response.status}: ${response.statusText}`); } return response.json(); })
+                            getRecipeDetails(recipeUrl)
                                 .then(data => {
                                     console.log("Received recipe details:", data); // Log received data
                                     modalLoadingIndicator.style.display = 'none';
@@ -425,40 +2873,409 @@ HTML_TEMPLATE = """
 </html>
 """
 
+# --- Pre-rendered Home Page ---
+# The home page only changes with the catalog (and sitemap errors), so it is rendered
+# once per catalog version and kept with gzip/brotli variants and strong ETags.
+_index_template = None
+_rendered_index = {'key': None}
+_rendered_index_lock = threading.Lock()
+
+def render_index_page(first_page, total, errors):
+    """Renders the home page HTML (the template is compiled once)."""
+    global _index_template
+    if _index_template is None:
+        _index_template = current_app.jinja_env.from_string(HTML_TEMPLATE)
+    with timed('render'):
+        return _index_template.render(recipes=first_page, total=total, page_size=SEARCH_PAGE_SIZE,
+                                      detail_batch_max=DETAIL_BATCH_MAX, errors=errors)
+
+
+def get_rendered_index():
+    """Returns the rendered home page of the current catalog: {'identity'|'gzip'|'br': (body, etag)}."""
+    global _rendered_index
+    _, errors = load_catalog()
+    key = (_catalog_cache['version'], tuple(errors))
+    if _rendered_index['key'] != key:
+        with _rendered_index_lock:
+            if _rendered_index['key'] != key:
+                total, first_page = get_search_index().search('', 1, SEARCH_PAGE_SIZE)
+                body = render_index_page(first_page, total, errors).encode('utf-8')
+                digest = hashlib.sha256(body).hexdigest()[:32]
+                rendered = {'key': key, 'total': total, 'identity': (body, f'"{digest}"'),
+                            'gzip': (gzip.compress(body, compresslevel=9), f'"{digest}-gzip"')}
+                if brotli is not None:
+                    rendered['br'] = (brotli.compress(body, quality=11), f'"{digest}-br"')
+                log.info("--- Rendered home page: %d unique recipes. Sitemap errors: %d ---", total, len(errors))
+                _rendered_index = rendered  # Swapped in one assignment, readers never see a partial page
+    return _rendered_index
+
+
 # --- Flask Routes (Keep as is from your file) ---
-@app.route('/')
+@routes.before_app_request
+def start_request_timing():
+    g.request_start = time.perf_counter()
+    _request_timings.set([] if SERVER_TIMING else None)  # Reset: worker threads are reused
+
+@routes.after_app_request
+def finish_request_timing(response):
+    elapsed = time.perf_counter() - g.request_start
+    endpoint = request.endpoint or 'unmatched'
+    METRICS.observe('food5_request_seconds', elapsed, endpoint=endpoint)
+    METRICS.inc('food5_requests_total', endpoint=endpoint, status=response.status_code)
+    timings = _request_timings.get()
+    if timings is not None:
+        totals = {}
+        for stage, seconds in timings:
+            totals[stage] = totals.get(stage, 0.0) + seconds
+        entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in totals.items()]
+        response.headers['Server-Timing'] = ', '.join(entries + [f"total;dur={elapsed * 1000:.1f}"])
+    return response
+
+@routes.route('/')
 def index():
-    all_recipes = []
-    fetch_errors = []
-    for url in SITEMAP_URLS:
-        recipes_data, error_data = fetch_and_parse_recipes(url)
-        if recipes_data: all_recipes.extend(recipes_data)
-        if error_data: fetch_errors.append(error_data)
-    unique_recipes = []
-    seen_urls = set()
-    for recipe in all_recipes:
-        if recipe.get('url') and recipe['url'] not in seen_urls:
-            unique_recipes.append(recipe)
-            seen_urls.add(recipe['url'])
-    print(f"--- Displaying {len(unique_recipes)} unique recipes. Sitemap errors: {len(fetch_errors)} ---")
-    return render_template_string(HTML_TEMPLATE, recipes=unique_recipes, errors=fetch_errors)
-
-@app.route('/get_recipe_details')
+    # Only reads the local catalog; a stale one is refreshed in the background
+    # Only the first page is rendered, the page fetches the rest from /api/search on demand
+    rendered = get_rendered_index()
+    schedule_catalog_refresh()
+    encoding = 'identity'
+    if 'br' in rendered and request.accept_encodings['br']: encoding = 'br'
+    elif request.accept_encodings['gzip']: encoding = 'gzip'
+    body, etag = rendered[encoding]
+    cached_etags = [rendered[e][1] for e in ('identity', 'gzip', 'br')
+                    if e in rendered and request.if_none_match.contains(rendered[e][1].strip('"'))]
+    if cached_etags:
+        # The client already has this catalog version (in whichever encoding it stored)
+        etag = cached_etags[0]
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='text/html')
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+    response.headers['ETag'] = etag
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'no-cache'  # Always revalidate: a 304 costs nothing
+    return response
+
+@routes.route('/api/search')
+def api_search():
+    query = request.args.get('q', '')
+    try:
+        page = max(1, int(request.args.get('page', 1)))
+        limit = min(100, max(1, int(request.args.get('limit', SEARCH_PAGE_SIZE))))
+    except ValueError:
+        return jsonify(success=False, error="'page' and 'limit' must be integers"), 400
+    with timed('search'):
+        total, results = get_search_index().search(query, page, limit)
+    return jsonify(success=True, query=query, page=page, limit=limit, total=total,
+                   pages=(total + limit - 1) // limit, results=results)
+
+@routes.route('/api/ingredients/search')
+def api_ingredients_search():
+    """Recipes by ingredient: ?with=poulet,citron&any=thym,romarin&without=crème or ?pantry=oeufs,farine,lait"""
+    def terms(name):
+        return [t.strip() for t in request.args.get(name, '').split(',') if t.strip()]
+    try:
+        page = max(1, int(request.args.get('page', 1)))
+        limit = min(100, max(1, int(request.args.get('limit', SEARCH_PAGE_SIZE))))
+    except ValueError:
+        return jsonify(success=False, error="'page' and 'limit' must be integers"), 400
+    query = {'all_of': terms('with'), 'any_of': terms('any'), 'none_of': terms('without'),
+             'pantry': terms('pantry') if 'pantry' in request.args else None}
+    if not any(query.values()) and query['pantry'] is None:
+        return jsonify(success=False, error="Give at least one of 'with', 'any', 'without' or 'pantry'"), 400
+    with timed('ingredient_search'):
+        total, results = get_ingredient_index().search(page, limit, **query)
+    return jsonify(success=True, page=page, limit=limit, total=total,
+                   pages=(total + limit - 1) // limit, results=results)
+
+@routes.route('/img/<int:recipe_id>')
+def recipe_image(recipe_id):
+    if Image is None:  # No Pillow: send the browser to the original image
+        row = get_db().execute("SELECT image_url FROM recipes WHERE id = ?", (recipe_id,)).fetchone()
+        return redirect(row['image_url']) if row and row['image_url'] else Response(status=404)
+    try:
+        found = get_thumbnail(recipe_id)
+    except FuturesTimeout:  # Still downloading: show the original this time, the thumbnail next time
+        row = get_db().execute("SELECT image_url FROM recipes WHERE id = ?", (recipe_id,)).fetchone()
+        response = redirect(row['image_url'])
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+    except (UpstreamUnavailable, DeadlineExceeded) as e:  # Image host down: let the browser retry soon
+        retry_after = max(1, int(getattr(e, 'retry_after', 0)))
+        return Response(status=503, headers={'Retry-After': str(retry_after), 'Cache-Control': 'no-store'})
+    if not found:
+        return Response(status=404, headers={'Cache-Control': 'public, max-age=3600'})  # Card shows its placeholder
+    ext = 'webp' if 'webp' in THUMBNAIL_FORMATS and 'image/webp' in request.headers.get('Accept', '') else 'jpg'
+    try:
+        response = send_file(thumbnail_path(recipe_id, ext), mimetype=THUMBNAIL_FORMATS[ext][1], max_age=IMAGE_MAX_AGE_SECONDS)
+    except FileNotFoundError:  # Evicted by another worker in the meantime: rebuilt on the next request
+        row = get_db().execute("SELECT image_url FROM recipes WHERE id = ?", (recipe_id,)).fetchone()
+        response = redirect(row['image_url'])
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+    response.headers['Vary'] = 'Accept'
+    return response
+
+PENDING_DETAILS = {'success': False, 'pending': True, 'error': "The recipe page is still loading."}
+MAX_SERVINGS = 100
+
+def parse_servings(value):
+    """Validates a `servings` request value: None (quantities as published) or an integer from 1 to MAX_SERVINGS."""
+    if value is None or value == '':
+        return None
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value)
+    if not isinstance(value, int) or isinstance(value, bool) or not 1 <= value <= MAX_SERVINGS:
+        raise ValueError(f"'servings' must be an integer from 1 to {MAX_SERVINGS}")
+    return value
+
+def detail_payload(result, servings=None):
+    """JSON body for one (details, error_message) result, as served by the detail endpoints."""
+    details, error_msg = result
+    if servings is not None and details['ingredients']: details = scale_details(details, servings)
+    if error_msg and not details['ingredients'] and not details['steps']: return {'success': False, 'error': error_msg}
+    elif error_msg: return {'success': True, 'details': details, 'warning': error_msg}
+    else: return {'success': True, 'details': details}
+
+def find_catalog_recipes(urls=(), ids=()):
+    """Returns {url: id} for the given recipe URLs and ids that are in the catalog."""
+    conn = get_db()
+    found = {}
+    for column, values in (('url', urls), ('id', ids)):
+        if values:
+            placeholders = ', '.join('?' * len(values))
+            for row in conn.execute(f"SELECT id, url FROM recipes WHERE {column} IN ({placeholders})", list(values)):
+                found[row['url']] = row['id']
+    return found
+
+def iter_recipe_details(urls, timeout=DETAIL_WAIT_SECONDS, max_scrapes=None):
+    """Yields (url, result, outcome) for several recipes: cache hits first, then scrapes as they finish.
+
+    The misses (the first `max_scrapes` of them when given) are submitted to the scrape
+    pool at once and waited on for at most `timeout` seconds in total. `result` is a
+    (details, error_message) pair, or None (outcome 'pending') for a recipe still loading
+    by then, whose scrape goes on and lands in the cache, or for a miss past `max_scrapes`,
+    which is not scraped at all.
+    """
+    hits, scrapes, skipped = [], {}, []
+    for url in urls:
+        result = DETAIL_CACHE.lookup(url)  # Memory, then disk
+        if result is not None:
+            hits.append((url, result))
+        elif max_scrapes is not None and len(scrapes) >= max_scrapes:
+            skipped.append(url)
+        else:
+            scrapes[DETAIL_CACHE.submit(url, SCRAPE_EXECUTOR)] = url
+    for url, result in hits:
+        yield url, result, 'hit'
+    for url in skipped:
+        yield url, None, 'pending'
+    remaining = dict(scrapes)
+    try:
+        for future in as_completed(scrapes, timeout=timeout):
+            yield remaining.pop(future), _scrape_result(future), 'scraped'
+    except FuturesTimeout:
+        for future, url in remaining.items():
+            yield (url, _scrape_result(future), 'scraped') if future.done() else (url, None, 'pending')
+
+def _scrape_result(future):
+    try:
+        return future.result()
+    except Exception as e:
+        log.exception("Recipe scrape failed")
+        return {'ingredients': [], 'steps': []}, f"Unexpected error scraping: {e}"
+
+@routes.route('/get_recipe_details')
 def get_recipe_details():
     recipe_url = request.args.get('url')
     if not recipe_url: return jsonify(success=False, error="Missing 'url' parameter"), 400
     if not recipe_url.startswith(('http://', 'https://')): return jsonify(success=False, error="Invalid URL format"), 400
-    details, error_msg = scrape_recipe_details(recipe_url) # Call the modified scraper
-    if error_msg and not details['ingredients'] and not details['steps']: return jsonify(success=False, error=error_msg)
-    elif error_msg: return jsonify(success=True, details=details, warning=error_msg)
-    else: return jsonify(success=True, details=details)
+    # Only catalog recipes are scraped and cached, like /api/recipes/details: arbitrary URLs
+    # would grow the details cache, the upstream host table and the metric series without bound
+    if not find_catalog_recipes([recipe_url]): return jsonify(success=False, error="Not a catalog recipe"), 404
+    try: servings = parse_servings(request.args.get('servings'))
+    except ValueError as e: return jsonify(success=False, error=str(e)), 400
+    result = DETAIL_CACHE.lookup(recipe_url) # Memory, then disk
+    if result is None:
+        # Scraped on the bounded scrape pool: a slow upstream cannot hold this worker for long,
+        # the page keeps polling and gets the result from the cache once the scrape is done
+        try: result = DETAIL_CACHE.submit(recipe_url, SCRAPE_EXECUTOR).result(timeout=DETAIL_WAIT_SECONDS)
+        except FuturesTimeout: return jsonify(PENDING_DETAILS), 202
+    return jsonify(detail_payload(result, servings))
+
+@routes.route('/api/recipes/details', methods=['POST'])
+def api_recipe_details():
+    """Details of several catalog recipes at once: {"urls": [...], "ids": [...], "servings": 4}.
+
+    Cached recipes are answered immediately and the misses scraped concurrently on the
+    scrape pool, waiting at most DETAIL_WAIT_SECONDS in total; recipes still loading after
+    that come back as pending (the scrape goes on and lands in the cache). Results are one
+    JSON document in request order, or with `Accept: application/x-ndjson` one line per
+    recipe as soon as it is ready.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict): body = {'urls': None}
+    urls, ids = body.get('urls', []), body.get('ids', [])
+    if not (isinstance(urls, list) and isinstance(ids, list) and all(isinstance(u, str) for u in urls)
+            and all(isinstance(i, int) and not isinstance(i, bool) for i in ids)):
+        return jsonify(success=False, error="Expected a JSON object with 'urls' (strings) and/or 'ids' (integers)"), 400
+    try: servings = parse_servings(body.get('servings'))
+    except ValueError as e: return jsonify(success=False, error=str(e)), 400
+    urls, ids = list(dict.fromkeys(urls)), list(dict.fromkeys(ids))
+    if len(urls) + len(ids) > DETAIL_BATCH_MAX:
+        return jsonify(success=False, error=f"At most {DETAIL_BATCH_MAX} recipes per request"), 400
+    known = find_catalog_recipes(urls, ids)
+    url_by_id = {recipe_id: url for url, recipe_id in known.items()}
+    requested = [(url, known.get(url)) for url in urls] + [(url_by_id.get(i), i) for i in ids if url_by_id.get(i) not in urls]
+    id_by_url = {url: recipe_id for url, recipe_id in requested if url is not None and recipe_id is not None}
+
+    def results():
+        """Yields ((url, id), payload): unknown recipes and cache hits first, then scrapes as they finish."""
+        for url, recipe_id in requested:
+            if url is None or recipe_id is None:
+                METRICS.inc('food5_detail_batch_items_total', result='unknown')
+                yield (url, recipe_id), {'success': False, 'error': "Not a catalog recipe"}
+        for url, result, outcome in iter_recipe_details(list(id_by_url)):
+            METRICS.inc('food5_detail_batch_items_total', result=outcome)
+            yield (url, id_by_url[url]), PENDING_DETAILS if result is None else detail_payload(result, servings)
+
+    if 'application/x-ndjson' in request.headers.get('Accept', ''):
+        lines = (json.dumps(dict(payload, url=url, id=recipe_id), ensure_ascii=False) + '\n'
+                 for (url, recipe_id), payload in results())
+        return Response(lines, mimetype='application/x-ndjson', headers={'X-Accel-Buffering': 'no'})
+    by_key = dict(results())
+    return jsonify(success=True, results=[dict(by_key[key], url=key[0], id=key[1]) for key in requested])
+
+@routes.route('/api/shopping-list', methods=['POST'])
+def api_shopping_list():
+    """Adds up the ingredients of several catalog recipes.
+
+    Body: {"recipes": [{"url": ...} or {"id": ..., "servings": 4}, ...], "servings": 6}; a
+    recipe without its own `servings` uses the top-level one (default RECIPE_SERVINGS) and
+    a recipe listed twice counts twice. Details are gathered like /api/recipes/details:
+    recipes still loading after DETAIL_WAIT_SECONDS are listed under `pending`, so the
+    client can ask again once they are cached. At most DETAIL_BATCH_MAX uncached recipes
+    are scraped per request so that one list cannot fill the shared scrape pool; the
+    others are listed under `pending` too and scraped when the client asks again.
+    """
+    body = request.get_json(silent=True)
+    entries = body.get('recipes') if isinstance(body, dict) else None
+    if not isinstance(entries, list) or not all(
+            isinstance(e, dict) and (isinstance(e.get('url'), str) or (isinstance(e.get('id'), int) and not isinstance(e.get('id'), bool)))
+            for e in entries):
+        return jsonify(success=False, error="Expected a JSON object with a 'recipes' list of {'url'} or {'id'} objects"), 400
+    if len(entries) > SHOPPING_LIST_MAX_RECIPES:
+        return jsonify(success=False, error=f"At most {SHOPPING_LIST_MAX_RECIPES} recipes per shopping list"), 400
+    try:
+        default_servings = parse_servings(body.get('servings')) or RECIPE_SERVINGS
+        servings = [parse_servings(e.get('servings')) or default_servings for e in entries]
+    except ValueError as e:
+        return jsonify(success=False, error=str(e)), 400
+    known = find_catalog_recipes([e['url'] for e in entries if isinstance(e.get('url'), str)],
+                                 [e['id'] for e in entries if not isinstance(e.get('url'), str)])
+    url_by_id = {recipe_id: url for url, recipe_id in known.items()}
+    servings_by_url, unknown = {}, []
+    for entry, entry_servings in zip(entries, servings):
+        url = entry['url'] if isinstance(entry.get('url'), str) else url_by_id.get(entry['id'])
+        if url not in known:
+            unknown.append(entry.get('url', entry.get('id')))
+        else:
+            servings_by_url[url] = servings_by_url.get(url, 0) + entry_servings
+    recipes, pending, failed = [], [], []
+    for url, result, _ in iter_recipe_details(list(servings_by_url), max_scrapes=DETAIL_BATCH_MAX):
+        if result is None: pending.append(url)
+        elif not result[0]['ingredients']: failed.append(url)
+        else: recipes.append((result[0], servings_by_url[url]))
+    with timed('shopping_list'):
+        items = build_shopping_list(recipes)
+    return jsonify(success=True, recipes=len(recipes), items=items, pending=pending, failed=failed, unknown=unknown)
+
+@routes.route('/metrics')
+def metrics():
+    stats = DETAIL_CACHE.stats()
+    samples = [(('food5_detail_cache_entries', ()), stats.pop('entries')), (('food5_detail_cache_bytes', ()), stats.pop('bytes'))]
+    samples += [(('food5_detail_cache_events_total', (('event', event),)), count) for event, count in stats.items()]
+    samples += upstream_samples()
+    return Response(METRICS.render(samples), mimetype='text/plain; version=0.0.4')
+
+# --- App Factory & Production Server ---
+def create_app():
+    """Builds the Flask app. Production WSGI servers can also use it directly: gunicorn 'food5:create_app()'."""
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(name)s: %(message)s')  # No-op if the server configured logging
+    flask_app = Flask(__name__)
+    flask_app.register_blueprint(routes)
+    return flask_app
+
+
+def serve_production(host=APP_HOST, port=APP_PORT, workers=APP_WORKERS, threads=APP_THREADS, worker_class=APP_WORKER_CLASS):
+    """Runs the app under gunicorn (multi-process), or waitress where gunicorn is unavailable (Windows)."""
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        try: from waitress import serve
+        except ImportError: print("Error: Install gunicorn (Linux/macOS) or waitress (Windows) to use 'serve'"); sys.exit(1)
+        print(f"Starting waitress with {threads} threads. View at http://{host}:{port}")
+        serve(create_app(), host=host, port=port, threads=threads)
+        return
+
+    class GunicornApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f'{host}:{port}')
+            self.cfg.set('workers', workers)
+            self.cfg.set('worker_class', worker_class)
+            self.cfg.set('threads', threads)
+            self.cfg.set('worker_connections', threads * 10)  # gevent: concurrent requests per worker
+            self.cfg.set('timeout', 60)
+            self.cfg.set('keepalive', 5)
+
+        def load(self):
+            return create_app()
+
+    print(f"Starting gunicorn: {workers} {worker_class} workers x {threads} threads. View at http://{host}:{port}")
+    GunicornApplication().run()
+
+
+app = create_app()
 
 # --- Run the App (Keep as is from your file) ---
 if __name__ == '__main__':
     try: import bs4; import lxml
     except ImportError: print("Error: Install beautifulsoup4 and lxml"); sys.exit(1)
     if sys.version_info[0] < 3: print("Warning: Requires Python 3."); sys.exit(1)
-    print(f"Starting Flask server. View at http://127.0.0.1:5200")
-    app.run(port=5200, debug=True) # Use debug=True for development
+    parser = argparse.ArgumentParser(description="20.000 Recipes")
+    commands = parser.add_subparsers(dest='command')
+    crawl_parser = commands.add_parser('crawl', help='pre-scrape every catalog recipe into the local recipe database')
+    crawl_parser.add_argument('--workers', type=int, default=CRAWL_WORKERS)
+    crawl_parser.add_argument('--rate', type=float, default=CRAWL_RATE, help='max pages per second (politeness limit)')
+    crawl_parser.add_argument('--limit', type=int, default=None, help='stop after this many recipes')
+    crawl_parser.add_argument('--refresh', action='store_true', help='also re-scrape recipes older than the detail TTL')
+    thumbnails_parser = commands.add_parser('thumbnails', help='pre-create the card thumbnails of every catalog recipe')
+    thumbnails_parser.add_argument('--workers', type=int, default=CRAWL_WORKERS, help='download threads')
+    thumbnails_parser.add_argument('--processes', type=int, default=None, help='resize processes (default: CPU count)')
+    thumbnails_parser.add_argument('--rate', type=float, default=CRAWL_RATE, help='max images per second')
+    thumbnails_parser.add_argument('--limit', type=int, default=None, help='only process the first N recipes')
+    sync_parser = commands.add_parser('sync', help='refresh the sitemaps and re-scrape only new and changed recipes')
+    sync_parser.add_argument('--workers', type=int, default=CRAWL_WORKERS)
+    sync_parser.add_argument('--rate', type=float, default=CRAWL_RATE, help='max pages per second (politeness limit)')
+    sync_parser.add_argument('--limit', type=int, default=None, help='stop after this many recipes')
+    serve_parser = commands.add_parser('serve', help='production mode: multi-worker WSGI server, no debugger')
+    serve_parser.add_argument('--host', default=APP_HOST)
+    serve_parser.add_argument('--port', type=int, default=APP_PORT)
+    serve_parser.add_argument('--workers', type=int, default=APP_WORKERS)
+    serve_parser.add_argument('--threads', type=int, default=APP_THREADS)
+    serve_parser.add_argument('--worker-class', default=APP_WORKER_CLASS, help="gunicorn worker class: 'gthread' or 'gevent'")
+    args = parser.parse_args()
+    if args.command == 'crawl':
+        crawl_catalog(args.workers, args.rate, args.limit, args.refresh)
+        sys.exit(0)
+    if args.command == 'sync':
+        sys.exit(0 if sync_catalog(args.workers, args.rate, args.limit) is not None else 1)
+    if args.command == 'thumbnails':
+        sys.exit(0 if prewarm_thumbnails(args.workers, args.processes, args.rate, args.limit) is not None else 1)
+    if args.command == 'serve':
+        serve_production(args.host, args.port, args.workers, args.threads, args.worker_class)
+        sys.exit(0)
+    print(f"Starting Flask server. View at http://{APP_HOST}:{APP_PORT}")
+    app.run(host=APP_HOST, port=APP_PORT, debug=APP_DEBUG) # APP_DEBUG=1 (default) for development
 
 # --- END OF FINAL CORRECTED FILE food.py ---
\ No newline at end of file